@@ -1,48 +1,467 @@
-from chemicals import Molecule
-from collections import Counter
+from cache import LRUCache
+from chemicals import get_composition, hill_formula, Composition, BY_NUMBER
+from elements import lazyattr
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from itertools import islice, product
+from json import dumps
+from math import gcd, isqrt
 from my_stuff.misc import init
+from os import cpu_count
+from time import perf_counter
+from timing import timed
 
-def lcm (nums) -> int: 
-    max_denom = float("-inf")
-    denoms = set()
-    for fraction in nums: 
-        denoms.add(fraction.denom)
-        if fraction.denom > max_denom: max_denom = fraction.denom
+try: import numpy
+except ImportError: numpy = None  # the "numpy" solver falls back to "modular"
+
+class UnbalanceableError (ValueError): 
+    """Raised for equations that no set of positive coefficients can balance."""
+
+class BudgetExceeded (Exception): 
+    """Raised when an equation goes over its time or size budget, see `balance`."""
+
+deadline: float = None  # perf_counter() time the current equation must be done by
 
-    result = max_denom
-    while any (result % denom for denom in denoms): 
-        result += max_denom
+def check_deadline () -> None: 
+    """Called between steps of the long loops, so they can be cancelled."""
+    if deadline is not None and perf_counter() > deadline: 
+        raise BudgetExceeded ("Ran out of time")
 
+@contextmanager
+def time_budget (seconds: float = None): 
+    """
+    Makes `check_deadline` raise BudgetExceeded once `seconds` have passed. 
+    A budget inside another one cannot outlast it. None means no limit. 
+    """
+    global deadline
+    previous = deadline
+    if seconds is not None: 
+        end = perf_counter() + seconds
+        deadline = end if previous is None else min (previous, end)
+    try: yield
+    finally: deadline = previous
+
+def lcm (nums) -> int: 
+    result = 1
+    for fraction in nums: 
+        result = result * fraction.denom // gcd (result, fraction.denom)
     return result
 
+def divide_gcd (values: [int]) -> [int]: 
+    divisor = 0
+    for value in values: divisor = gcd (divisor, value)
+    if divisor in (0, 1): return list (values)
+    else: return [value // divisor for value in values]
+
 def expand_fractions(nullspace: list): 
     lcd = lcm (nullspace)
-    return [
+    return divide_gcd ([
         abs (val.num * (lcd // val.denom))
         for val in nullspace
-    ]
+    ])
+
+@timed
+def hermite_normal_form (rows: [[int]], cols: int) -> int: 
+    """
+    Brings `rows` into row-style Hermite normal form over their first `cols` 
+    columns, in place, using only unimodular row operations. 
+
+    Returns the rank, which is also the index of the first row that is all 
+    zeros in those columns. 
+    """
+    pivot_row = 0
+    for col in range (cols): 
+        check_deadline()
+        # Euclid's algorithm down the column: always reducing by the smallest 
+        # entry keeps the rest of the row from blowing up
+        while True: 
+            smallest = None
+            for row in range (pivot_row, len (rows)): 
+                value = rows [row] [col]
+                if value and (smallest is None or abs (value) < abs (rows [smallest] [col])): 
+                    smallest = row
+            if smallest is None: break
+            rows [pivot_row], rows [smallest] = rows [smallest], rows [pivot_row]
+            pivot = rows [pivot_row]
+            done = True
+            for row in range (pivot_row + 1, len (rows)): 
+                value = rows [row] [col]
+                if not value: continue
+                quotient = value // pivot [col]
+                rows [row] = [a - quotient * b for a, b in zip (rows [row], pivot)]
+                if rows [row] [col]: done = False
+            if done: break
+
+        if pivot_row == len (rows) or rows [pivot_row] [col] == 0: continue
+        if rows [pivot_row] [col] < 0: 
+            rows [pivot_row] = [-value for value in rows [pivot_row]]
+
+        pivot = rows [pivot_row] [col]
+        for row in range (pivot_row):  # reduce everything above the pivot
+            quotient = rows [row] [col] // pivot
+            if quotient: rows [row] = [
+                a - quotient * b for a, b in zip (rows [row], rows [pivot_row])
+            ]
+        pivot_row += 1
+        if pivot_row == len (rows): break
+    return pivot_row
+
+# The largest primes below 2 ** 31, so products of two residues stay small
+PRIMES: (int,) = (
+    2147483647, 2147483629, 2147483587, 2147483579, 
+    2147483563, 2147483549, 2147483543, 2147483497, 
+    2147483489, 2147483477, 2147483423, 2147483399, 
+    2147483353, 2147483323, 2147483269, 2147483249,
+)
+
+@timed
+def modular_rref (rows: [[int]], prime: int) -> ([[int]], [int]): 
+    """Returns the reduced row echelon form of `rows` modulo `prime`, and its pivot columns."""
+    rows = [[value % prime for value in row] for row in rows]
+    pivots = []
+    pivot_row = 0
+    for col in range (len (rows [0]) if rows else 0): 
+        check_deadline()
+        for row in range (pivot_row, len (rows)): 
+            if rows [row] [col]: break
+        else: continue
+        rows [pivot_row], rows [row] = rows [row], rows [pivot_row]
+        inverse = pow (rows [pivot_row] [col], -1, prime)
+        pivot = rows [pivot_row] = [value * inverse % prime for value in rows [pivot_row]]
+        for row in range (len (rows)): 
+            value = rows [row] [col]
+            if row == pivot_row or not value: continue
+            rows [row] = [(a - value * b) % prime for a, b in zip (rows [row], pivot)]
+        pivots.append (col)
+        pivot_row += 1
+        if pivot_row == len (rows): break
+    return rows, pivots
+
+def rational_reconstruction (value: int, modulus: int) -> "Fraction": 
+    """
+    Returns the unique fraction n/d congruent to `value` modulo `modulus` with
+    |n|, d <= sqrt (modulus / 2), or None if there isn't one. 
+    """
+    bound = isqrt (modulus // 2)
+    remainder, next_remainder = modulus, value % modulus
+    coefficient, next_coefficient = 0, 1
+    while next_remainder > bound: 
+        quotient = remainder // next_remainder
+        remainder, next_remainder = next_remainder, remainder - quotient * next_remainder
+        coefficient, next_coefficient = next_coefficient, coefficient - quotient * next_coefficient
+    if next_coefficient == 0 or abs (next_coefficient) > bound: return None
+    if gcd (next_remainder, next_coefficient) != 1: return None
+    return Fraction (next_remainder, next_coefficient)
+
+def saturate (basis: [[int]]) -> [[int]]: 
+    """
+    Returns every integer vector in the span of `basis`, as the Hermite normal 
+    form basis `Matrix.integer_nullspace` would give. 
+
+    Solvers that work over the rationals can return a basis of a smaller 
+    lattice, like 5 times one vector. The vectors orthogonal to the basis 
+    have exactly the span as their nullspace, so its integer nullspace is the 
+    whole lattice, the same one for any basis of the same span. 
+    """
+    cols = len (basis [0])
+    complement = sparse_kernel ([
+        {col: value for col, value in enumerate (vector) if value} for vector in basis
+    ], cols)
+    if not complement: return [[int (row == col) for col in range (cols)] for row in range (cols)]
+    return Matrix ([
+        [vector.get (col, 0) for col in range (cols)] for vector in complement
+    ]).integer_nullspace()
+
+@timed
+def choose_coefficients (basis: [[int]], limit: int = 20_000) -> [int]: 
+    """
+    Picks positive coefficients from the nullspace `basis`: the combination 
+    with the smallest sum among those whose weights are all in [-bound, bound], 
+    for the smallest bound where there is one. That is not always the 
+    smallest solution overall, but it only depends on the nullspace, since 
+    the basis is saturated and put in Hermite normal form first, so every 
+    solver gets the same answer. 
+
+    The bound grows until something works or `limit` combinations would have 
+    to be checked. With one free variable this is just the basis vector, 
+    possibly negated. Raises ValueError when nothing is found, see 
+    `positive_solution`. 
+    """
+    if len (basis) > 1 and 3 ** len (basis) <= limit: basis = saturate (basis)
+    if len (basis) == 1:  # only the vector or its negation can work, no matter the bound
+        vector = basis [0] if basis [0] and basis [0] [0] > 0 else [-value for value in basis [0]]
+        if all (value > 0 for value in vector): return divide_gcd (vector)
+        raise ValueError ("There is no set of positive coefficients that balances this equation")
+    best = None
+    bound = 1
+    while basis and (2 * bound + 1) ** len (basis) <= limit: 
+        check_deadline()
+        for weights in product (range (-bound, bound + 1), repeat = len (basis)): 
+            if max (map (abs, weights)) != bound: continue  # checked with a smaller bound
+            vector = [
+                sum (weight * value for weight, value in zip (weights, values))
+                for values in zip (*basis)
+            ]
+            if any (value <= 0 for value in vector): continue
+            vector = divide_gcd (vector)
+            if best is None or sum (vector) < sum (best): best = vector
+        if best is not None: return best
+        bound += 1
+    raise ValueError ("There is no set of positive coefficients that balances this equation")
+
+@timed
+def positive_solution (rows: [{int: int}], cols: int) -> [int]: 
+    """
+    Finds positive integer coefficients x with rows * x == 0, for when the 
+    nullspace has too many free variables for `choose_coefficients` to search. 
+
+    Substituting x = 1 + y turns this into finding y >= 0 with rows * y == b, 
+    which is phase one of the simplex method. There is one constraint per 
+    element, so the tableau stays small even with hundreds of species. Bland's
+    rule keeps it from cycling. Raises UnbalanceableError if there is no solution. 
+    """
+    rows = [[row.get (col, 0) for col in range (cols)] for row in rows]
+    targets = [-sum (row) for row in rows]
+    tableau = []
+    for index, (row, target) in enumerate (zip (rows, targets)): 
+        sign = -1 if target < 0 else 1
+        artificial = [Fraction (int (index == other)) for other in range (len (rows))]
+        tableau.append ([Fraction (sign * value) for value in row] + artificial + [Fraction (sign * target)])
+    basic = [cols + index for index in range (len (rows))]
+    # reduced costs of minimizing the sum of the artificial variables
+    costs = [-sum (column, Fraction (0)) for column in zip (*tableau)]
+    for index in range (cols, cols + len (rows)): costs [index] = Fraction (0)
+
+    while True: 
+        check_deadline()
+        entering = next ((col for col in range (cols + len (rows)) if costs [col] < 0), None)
+        if entering is None: break
+        leaving = None
+        for index, row in enumerate (tableau): 
+            if row [entering] <= 0: continue
+            ratio = row [-1] / row [entering]
+            if leaving is None or (ratio, basic [index]) < (best, basic [leaving]): 
+                leaving, best = index, ratio
+        pivot_row = tableau [leaving] = [value / tableau [leaving] [entering] for value in tableau [leaving]]
+        for index, row in enumerate (tableau): 
+            factor = row [entering]
+            if index == leaving or not factor: continue
+            tableau [index] = [a - factor * b for a, b in zip (row, pivot_row)]
+        factor = costs [entering]
+        costs = [a - factor * b for a, b in zip (costs, pivot_row)]
+        basic [leaving] = entering
+
+    if costs [-1] != 0: 
+        raise UnbalanceableError ("There is no set of positive coefficients that balances this equation")
+    solution = [Fraction (1)] * cols
+    for index, col in enumerate (basic): 
+        if col < cols: solution [col] += tableau [index] [-1]
+    lcd = lcm (solution)
+    return divide_gcd ([value.num * (lcd // value.denom) for value in solution])
+
+def sparse_rref (rows: [{int: int}]) -> ([{int: int}], {int: int}, {int: {int}}): 
+    """
+    Gauss-Jordan elimination on a sparse integer matrix, where each row maps 
+    a column to its (nonzero) value. 
+
+    Only the nonzeros are touched. Each pivot is picked with the Markowitz 
+    rule: the entry whose row and column have the fewest other nonzeros, 
+    which keeps fill-in low. Rows stay integers, divided by their gcd after 
+    every update. Returns the reduced rows, {row: pivot column}, and 
+    {column: rows with a nonzero there}. 
+    """
+    rows = [dict (row) for row in rows if row]
+    col_rows: {int: {int}} = {}
+    for index, row in enumerate (rows): 
+        for col in row: col_rows.setdefault (col, set()).add (index)
+
+    pivots: {int: int} = {}
+    active = set (range (len (rows)))
+    while active: 
+        check_deadline()
+        best = None
+        for index in active: 
+            row = rows [index]
+            for col, value in row.items(): 
+                cost = ((len (row) - 1) * (len (col_rows [col]) - 1), abs (value))
+                if best is None or cost < best [0]: best = cost, index, col
+        _, pivot_row, pivot_col = best
+        pivot = rows [pivot_row]
+        pivot_value = pivot [pivot_col]
+
+        for index in col_rows [pivot_col] - {pivot_row}: 
+            row = rows [index]
+            value = row [pivot_col]
+            for col in row: row [col] *= pivot_value
+            for col, entry in pivot.items(): 
+                new = row.get (col, 0) - value * entry
+                if new: 
+                    if col not in row: col_rows [col].add (index)
+                    row [col] = new
+                elif col in row: 
+                    del row [col]
+                    col_rows [col].discard (index)
+            divisor = 0
+            for entry in row.values(): divisor = gcd (divisor, entry)
+            for col in row: row [col] //= divisor
+            if not row: active.discard (index)
+
+        pivots [pivot_row] = pivot_col
+        active.discard (pivot_row)
+    return rows, pivots, col_rows
+
+def sparse_kernel (rows: [{int: int}], cols: int) -> [{int: int}]: 
+    """
+    Returns a basis for the nullspace of a sparse integer matrix (see 
+    `sparse_rref`), with each vector as {column: value} without the zeros. 
+    Each vector sets one free column, positive, and the pivots it feeds into. 
+    """
+    rows, pivots, col_rows = sparse_rref (rows)
+    pivot_cols = set (pivots.values())
+    basis = []
+    for free in range (cols): 
+        if free in pivot_cols: continue
+        dependents = [index for index in col_rows.get (free, ()) if index in pivots]
+        scale = 1  # lcm of the pivots that this column feeds into
+        for index in dependents: 
+            pivot_value = abs (rows [index] [pivots [index]])
+            scale = scale * pivot_value // gcd (scale, pivot_value)
+        vector = {free: scale}
+        for index in dependents: 
+            row = rows [index]
+            vector [pivots [index]] = -row [free] * scale // row [pivots [index]]
+        divisor = 0
+        for value in vector.values(): divisor = gcd (divisor, value)
+        basis.append ({col: value // divisor for col, value in vector.items()})
+    return basis
+
+@timed
+def sparse_nullspace (rows: [{int: int}], cols: int) -> [[int]]: 
+    """Returns a basis for the nullspace of a sparse integer matrix, see `sparse_kernel`."""
+    basis = []
+    for vector in sparse_kernel (rows, cols): 
+        dense = [0] * cols
+        for col, value in vector.items(): dense [col] = value
+        basis.append (dense)
+    return basis
 
 class Fraction: 
-    @init
-    def init (self, num, denom, negative): pass
-    def __repr__(self): return f"{'-' if self.negative else ''}({self.num}/{self.denom})"
-    def __new__(cls, num, denom): 
-        # if num == 0: return 0
+    def __repr__(self): return f"{'-' if self.negative else ''}({abs (self.num)}/{self.denom})"
+    def __new__(cls, num, denom = 1): 
         if denom == 0: raise ZeroDivisionError()
-        negative: bool = (num >= 0) != (denom >= 0)
-        num = abs (num)
-        denom = abs (denom)
-        for n in range (num, 1, -1):  # simplify
-            if not num % n and not denom % n: 
-                num //= n
-                denom //= n
-
+        if denom < 0: num, denom = -num, -denom
+        divisor = gcd (num, denom)  # gcd (0, denom) == denom, so 0 becomes 0/1
         fraction: Fraction = object.__new__(cls)
-        fraction.init(num, denom, negative)
+        fraction.num = num // divisor
+        fraction.denom = denom // divisor
         return fraction
 
-    def to_float(self): return self.num / self.denom * (-1 if self.negative else 1)
+    @property
+    def negative(self): return self.num < 0
 
+    @staticmethod
+    def coerce(value): 
+        if type (value) is Fraction: return value
+        elif type (value) is int: return Fraction (value, 1)
+        else: return NotImplemented
+
+    def __add__(self, other): 
+        other = Fraction.coerce (other)
+        if other is NotImplemented: return other
+        return Fraction (
+            self.num * other.denom + other.num * self.denom, 
+            self.denom * other.denom
+        )
+
+    def __sub__(self, other): 
+        other = Fraction.coerce (other)
+        if other is NotImplemented: return other
+        return Fraction (
+            self.num * other.denom - other.num * self.denom, 
+            self.denom * other.denom
+        )
+
+    def __mul__(self, other): 
+        other = Fraction.coerce (other)
+        if other is NotImplemented: return other
+        return Fraction (self.num * other.num, self.denom * other.denom)
+
+    def __truediv__(self, other): 
+        other = Fraction.coerce (other)
+        if other is NotImplemented: return other
+        return Fraction (self.num * other.denom, self.denom * other.num)
+
+    def __radd__(self, other): return self + other
+    def __rmul__(self, other): return self * other
+    def __rsub__(self, other): return -self + other
+    def __rtruediv__(self, other): 
+        other = Fraction.coerce (other)
+        if other is NotImplemented: return other
+        return other / self
+
+    def __neg__(self): return Fraction (-self.num, self.denom)
+    def __abs__(self): return Fraction (abs (self.num), self.denom)
+    def __bool__(self): return self.num != 0
+
+    def compare(self, other) -> int: 
+        other = Fraction.coerce (other)
+        if other is NotImplemented: return other
+        difference = self.num * other.denom - other.num * self.denom
+        return (difference > 0) - (difference < 0)
+
+    def __eq__(self, other): 
+        result = self.compare (other)
+        return result if result is NotImplemented else result == 0
+
+    def __lt__(self, other): 
+        result = self.compare (other)
+        return result if result is NotImplemented else result < 0
+
+    def __le__(self, other): 
+        result = self.compare (other)
+        return result if result is NotImplemented else result <= 0
+
+    def __gt__(self, other): 
+        result = self.compare (other)
+        return result if result is NotImplemented else result > 0
+
+    def __ge__(self, other): 
+        result = self.compare (other)
+        return result if result is NotImplemented else result >= 0
+
+    # whole numbers hash like the equivalent int, so Fraction (2, 1) == 2 works in dicts
+    def __hash__(self): return hash (self.num) if self.denom == 1 else hash ((self.num, self.denom))
+
+    def to_float(self): return self.num / self.denom
+    def __float__(self): return self.to_float()
+
+
+RREF_METHODS = ("rational", "bareiss")
+
+def rref_solver (matrix: "Matrix") -> [[int]]: 
+    """A basis of the nullspace read off the reduced row echelon form, one vector per free column."""
+    rref = matrix.rref ("bareiss")
+    pivots = {}  # pivot column: row
+    for row in range (rref.rows): 
+        col = next ((col for col in range (rref.cols) if rref [row, col]), None)
+        if col is not None: pivots [col] = row
+    basis = []
+    for free in range (rref.cols): 
+        if free in pivots: continue
+        vector = [Fraction (int (col == free)) for col in range (rref.cols)]
+        for col, row in pivots.items(): vector [col] = -rref [row, free] / rref [row, col]
+        lcd = lcm (vector)
+        basis.append (divide_gcd ([value.num * (lcd // value.denom) for value in vector]))
+    return basis
+
+SOLVERS = {  # name: function (Matrix) -> [[int]], a basis of the nullspace
+    "rref": rref_solver,
+    "hnf": lambda matrix: matrix.integer_nullspace(),
+    "modular": lambda matrix: matrix.modular_nullspace(),
+    "numpy": lambda matrix: matrix.numpy_nullspace(),
+    "sparse": lambda matrix: matrix.sparse_nullspace(),
+}
 
 class Matrix: 
     @init
@@ -99,9 +518,32 @@ class Matrix:
             if all (num == 0 for num in col): return None, None
             else: return result_index, result
 
-    def rref(self):
+    @timed
+    def rref(self, method = "rational"):
+        """
+        Returns the reduced row echelon form, with every entry as a Fraction. 
+
+        `method` picks how rows are eliminated: 
+        - "rational" divides each pivot row by its pivot as it goes. 
+        - "bareiss" stays in integers and divides every row by the previous 
+            pivot (Bareiss), which keeps entries as small as the minors of the 
+            matrix instead of letting them grow exponentially with the rows. 
+            Only works on integer matrices. 
+        """
+        if method not in RREF_METHODS: 
+            raise ValueError (f"Unknown rref method {method!r}, expected one of {RREF_METHODS}")
+        fraction_free = method == "bareiss"
+        allowed = (int,) if fraction_free else (int, Fraction)
+        for value in self.flatten(): 
+            if type (value) not in allowed: raise TypeError (
+                f"The {method} rref only works on {' and '.join (kind.__name__ for kind in allowed)} entries, "
+                f"not {value!r} ({type (value).__name__})"
+            )
         cols = self.cols
-        matrix = self.flatten()
+        matrix = (
+            self.flatten() if fraction_free
+            else [Fraction.coerce (value) for value in self.flatten()]
+        )
 
         def get_col (index): return matrix [index::cols]
 
@@ -114,73 +556,277 @@ class Matrix:
                 matrix [index2_1 : index2_2], matrix [index1_1 : index1_2]
             )
 
-        def cross_cancel (row, value, pivot_row, pivot_value): 
+        def scale_row (row, value): 
+            for n in range (row * cols, (row + 1) * cols): 
+                matrix [n] /= value
+
+        def cancel (row, value, pivot_row): 
             offset = (pivot_row - row) * cols
             for n in range (row * cols, (row + 1) * cols): 
-                matrix [n] = pivot_value * matrix [n] - value * matrix [n + offset]
+                matrix [n] -= value * matrix [n + offset]
+
+        def cross_cancel (row, value, pivot_row, pivot_value, previous): 
+            # exact: every entry is a minor of the original matrix
+            offset = (pivot_row - row) * cols
+            for n in range (row * cols, (row + 1) * cols): 
+                matrix [n] = (pivot_value * matrix [n] - value * matrix [n + offset]) // previous
 
         pivot_row = 0
         pivot_col = 0
-        pivots = []
+        previous = 1
         while pivot_col < cols and pivot_row < self.rows:
+            check_deadline()
             offset, value = self.get_pivot (get_col (pivot_col) [pivot_row:])
 
             if offset is None: 
                 pivot_col += 1
                 continue
 
-            pivots.append (pivot_col)
             if offset != 0: swap_rows (pivot_row, offset + pivot_row)
 
-            for row in range (self.rows): 
-                if row == pivot_row: continue
+            if fraction_free: 
+                # every other row has to be rescaled, even if it is already 0 
+                # in this column, or the next division will not be exact
+                for row in range (self.rows): 
+                    if row == pivot_row: continue
+                    val = matrix [row * cols + pivot_col]
+                    cross_cancel (row, val, pivot_row, value, previous)
+                previous = value
+            else: 
+                scale_row (pivot_row, value)
+                for row in range (self.rows): 
+                    if row == pivot_row: continue
 
-                val = matrix [row * cols + pivot_col]
-                if val == 0: continue
-                else: cross_cancel (row, val, pivot_row, value)
+                    val = matrix [row * cols + pivot_col]
+                    if val == 0: continue
+                    else: cancel (row, val, pivot_row)
 
             pivot_row += 1
 
-        for index, col in enumerate (pivots):
-            temp = index * cols + col
-            value = matrix [temp]
-            matrix [temp] = 1
-            for index2 in range (temp + 1, (index + 1) * cols): 
-                matrix [index2] = Fraction (matrix [index2], value)
-
+        # Every pivot ends up equal to the last one, so one division normalizes
+        if fraction_free: matrix = [Fraction (value, previous) for value in matrix]
         return Matrix.fromDimensions(self.rows, self.cols, matrix)
 
-    def nullspace(self, simplify = True): 
-        rref = self.rref()
-        nullspace = [
-            rref [n, -1] 
-            for n in range (rref.rows)
+    def nullspace(self) -> [int]: 
+        """
+        Returns positive integer coefficients x with self * x == 0, picked the 
+        way `Equation.balance` picks them. Raises UnbalanceableError if there 
+        are none. 
+        """
+        try: return choose_coefficients (self.integer_nullspace())
+        except ValueError: return positive_solution (
+            [{col: value for col, value in enumerate (row) if value} for row in self], self.cols
+        )
+
+    def sparse_nullspace(self) -> [[int]]: return sparse_nullspace (
+        [{col: value for col, value in enumerate (row) if value} for row in self], 
+        self.cols
+    )
+
+    @timed
+    def integer_nullspace(self) -> [[int]]: 
+        """
+        Returns a basis for every integer vector x with self * x == 0. 
+
+        The transpose is augmented with the identity and brought into Hermite 
+        normal form. The rows whose matrix part vanishes carry the basis, which 
+        is then put into Hermite normal form itself, so it is unique and every 
+        vector is as small as the lattice allows. Only works on integer matrices. 
+        """
+        rows = [
+            [self.matrix [row] [col] for row in range (self.rows)] + 
+            [int (col == index) for index in range (self.cols)]
+            for col in range (self.cols)
         ]
-        
-            
-        for index, value in enumerate (nullspace): 
-            if value == 0: 
-                nullspace [index] = (
-                    Fraction (1, 1)
-                    if simplify
-                    else Fraction (0, 1)
-                )
-                    
-        if not simplify: return nullspace
-        nullspace.extend ([
-            Fraction (1, 1) 
-            for _ in range (rref.cols - len (nullspace))
-        ])
+        rank = hermite_normal_form (rows, self.rows)
+        basis = [row [self.rows:] for row in rows [rank:]]
+        hermite_normal_form (basis, self.cols)
+        return basis
+
+    @timed
+    def modular_nullspace(self, primes: (int,) = PRIMES) -> [[int]]: 
+        """
+        Returns a basis for the nullspace, solved modulo several word-sized primes. 
+
+        Each prime gets its own reduced row echelon form. Primes whose pivots 
+        disagree with the best ones seen are unlucky and are dropped. The rest 
+        are combined with the Chinese remainder theorem until every entry can be 
+        recovered with rational reconstruction and the resulting integer vectors
+        really are in the nullspace of this matrix. If the primes run out first, 
+        this falls back to `integer_nullspace`. Only works on integer matrices. 
+        """
+        best_pivots = None
+        residues = modulus = None
+        for prime in primes: 
+            check_deadline()
+            rows, pivots = modular_rref (self.matrix, prime)
+            if best_pivots is not None and (
+                len (pivots) < len (best_pivots) or 
+                (len (pivots) == len (best_pivots) and pivots > best_pivots)
+            ): continue  # unlucky prime
+            free = [col for col in range (self.cols) if col not in pivots]
+            basis = []
+            for col in free: 
+                vector = [0] * self.cols
+                vector [col] = 1
+                for row, pivot in enumerate (pivots): vector [pivot] = -rows [row] [col] % prime
+                basis.append (vector)
+
+            if pivots != best_pivots: 
+                best_pivots = pivots
+                residues, modulus = basis, prime
+            else: 
+                # Chinese remainder theorem, one entry at a time
+                inverse = pow (modulus, -1, prime)
+                residues = [
+                    [
+                        old + modulus * ((new - old) * inverse % prime)
+                        for old, new in zip (old_vector, new_vector)
+                    ]
+                    for old_vector, new_vector in zip (residues, basis)
+                ]
+                modulus *= prime
+
+            candidate = []
+            for vector in residues: 
+                fractions = [rational_reconstruction (value, modulus) for value in vector]
+                if None in fractions: break
+                lcd = lcm (fractions)
+                candidate.append (divide_gcd ([
+                    fraction.num * (lcd // fraction.denom) for fraction in fractions
+                ]))
+            else: 
+                if not any (
+                    sum (a * b for a, b in zip (row, vector)) 
+                    for vector in candidate
+                    for row in self.matrix
+                ): return candidate
+        return self.integer_nullspace()
+
+    @timed
+    def numpy_nullspace(self) -> [[int]]: 
+        """
+        Returns a basis for the nullspace, using fraction-free Gauss-Jordan 
+        elimination on an int64 NumPy array. 
+
+        Before every step the largest possible result is bounded, and if it 
+        could overflow int64 this hands the whole matrix to `modular_nullspace`,
+        which works on Python ints. It does the same if NumPy is not installed. 
+        """
+        if numpy is None or not self.rows: return self.modular_nullspace()
+        try: matrix = numpy.array (self.matrix, dtype = numpy.int64)
+        except OverflowError: return self.modular_nullspace()
+
+        limit = numpy.iinfo (numpy.int64).max
+        pivots = []
+        previous = 1
+        for col in range (self.cols): 
+            check_deadline()
+            pivot_row = len (pivots)
+            if pivot_row == self.rows: break
+            nonzero = numpy.flatnonzero (matrix [pivot_row:, col])
+            if not nonzero.size: continue
+            row = pivot_row + int (nonzero [0])
+            if row != pivot_row: matrix [[pivot_row, row]] = matrix [[row, pivot_row]]
+
+            pivot = int (matrix [pivot_row, col])
+            column = matrix [:, col].copy()
+            column [pivot_row] = 0
+            largest = int (numpy.abs (matrix).max())
+            if largest * (abs (pivot) + int (numpy.abs (column).max())) > limit: 
+                return self.modular_nullspace()
+
+            # same update as the "bareiss" rref, for every row at once
+            reduced = (pivot * matrix - numpy.outer (column, matrix [pivot_row])) // previous
+            reduced [pivot_row] = matrix [pivot_row]
+            matrix = reduced
+            previous = pivot
+            pivots.append (col)
+
+        # every pivot is now `previous`, so no fractions are needed
+        sign = -1 if previous < 0 else 1
+        basis = []
+        for col in range (self.cols): 
+            if col in pivots: continue
+            vector = [0] * self.cols
+            vector [col] = sign * previous
+            for row, pivot in enumerate (pivots): vector [pivot] = -sign * int (matrix [row, col])
+            basis.append (divide_gcd (vector))
+        return basis
 
 
-        return expand_fractions(nullspace)
+def consume_digits (formula: str, index: int) -> (int, int): 
+    """Reads the number starting at `index`. Returns (number or None, index after it)."""
+    end = index
+    while end < len (formula) and formula [end].isdigit(): end += 1
+    if end == index: return None, index
+    else: return int (formula [index:end]), end
+
+def parse_species (formula: str, index: int) -> ("Species", int): 
+    """
+    Reads one species, like 3Al2(SO4)3, starting at `index`. 
+
+    Returns the species and the index just after it. The composition comes 
+    from `chemicals.get_composition`, so there is one formula parser, and 
+    species seen before are not parsed again. 
+    """
+    coefficient, index = consume_digits (formula, index)
+    start = index
+    while index < len (formula) and formula [index] not in " +-": index += 1
+    if index == start: raise ValueError (f"Expected a species at position {start + 1}: {formula}")
+    try: composition = get_composition (formula [start:index])
+    except ValueError as error: raise ValueError (f"{error} (in {formula})") from None
+    return Species (formula [start:index], composition, 1 if coefficient is None else coefficient), index
+
+@timed
+def parse_equation (formula: str) -> [["Species"]]: 
+    """
+    Splits an equation like "H2 + O2 --> H2O" into its sides and species in a 
+    single pass. Returns a list of species for each side. 
+    """
+    sides = [[]]
+    index = 0
+    while True: 
+        while index < len (formula) and formula [index] == " ": index += 1
+        species, index = parse_species (formula, index)
+        sides [-1].append (species)
+        while index < len (formula) and formula [index] == " ": index += 1
+        if index == len (formula): return sides
+        elif formula.startswith ("-->", index): 
+            sides.append ([])
+            index += 3
+        elif formula [index] == "+": index += 1
+        else: raise ValueError (f"{formula [index]} at position {index + 1} was unexpected: {formula}")
+
+class Species: 
+    """
+    One species in an equation. 
+
+    Unlike chemicals.Molecule this only knows its composition, since that is
+    all balancing needs. Like Molecule, species are equal when they are 
+    written the same, so isomers like C2H5OH and CH3OCH3 stay apart. 
+    """
+    def __init__ (self, formula: str, elements: Composition, coefficient: int = 1): 
+        self.formula = self._base_molecule = formula
+        self.coefficient = coefficient
+        self.elements: Composition = elements  # shared, see chemicals.get_composition
+
+    @lazyattr
+    def hill_formula (self) -> str: return hill_formula (self.elements)
+
+    def __repr__ (self): return f"Species ({self.formula})"
+    def __eq__ (self, other): return type (other) is Species and self.formula == other.formula
+    def __hash__ (self): return hash (self.formula)
 
 
 class Side: 
-    def __init__ (self, formula: str):
-        self.molecules: [Molecule] = self.get_molecules(formula)
+    def __init__ (self, formula: str = None, species: [Species] = None):
+        if species is None: species = self.parse (formula)
+        self.molecules: {Species: int} = self.get_molecules(species)
         self.molecules_list = self.get_molecule_list(formula)
-        self.elements: {"Element": int} = self.get_elements()
+
+    @lazyattr
+    def elements (self) -> Composition: return self.get_elements()
 
     def __repr__ (self): return f"Side ({self})"
     def __str__ (self): return " + ".join ([
@@ -190,60 +836,335 @@ class Side:
 
     def get_molecule_list(self, formula): return list (self.molecules.keys())
 
-    def get_molecules (self, formula: str) -> [Molecule]: return {
-        Molecule (molecule._base_molecule): molecule.coefficient
-        for molecule in map (Molecule, formula.split (" + "))
+    def canonical(self) -> [(str, int)]: 
+        """Returns (Hill formula, position) for every species, sorted by formula."""
+        return sorted (
+            (molecule.hill_formula, index) 
+            for index, molecule in enumerate (self.molecules_list)
+        )
+
+    def parse (self, formula: str) -> [Species]: 
+        sides = parse_equation (formula)
+        if len (sides) != 1: raise SyntaxError (f"A side cannot contain -->: {formula}")
+        return sides [0]
+
+    def get_molecules (self, species: [Species]) -> {Species: int}: return {
+        molecule: molecule.coefficient for molecule in species
     }
 
-    def get_elements (self) -> {"Element": int}: 
-        elements: Counter = Counter()
-        for molecule, coefficient, in self.molecules.items():
-            for element, count in molecule.elements.items():
-                elements [element] += count * coefficient
-        return elements
+    def add (self, species: Species) -> None: 
+        self.molecules [species] = species.coefficient
+        self.molecules_list.append (species)
+        self.__dict__.pop ("elements", None)
+
+    def remove (self, species: Species) -> None: 
+        del self.molecules [species]
+        self.molecules_list.remove (species)
+        self.__dict__.pop ("elements", None)
+
+    def replace (self, old: Species, new: Species) -> None: 
+        """Puts `new` where `old` was, so the other species keep their positions."""
+        self.molecules = {
+            (new if molecule == old else molecule): (new.coefficient if molecule == old else count)
+            for molecule, count in self.molecules.items()
+        }
+        self.molecules_list = self.get_molecule_list (None)
+        self.__dict__.pop ("elements", None)
+
+    def get_elements (self) -> Composition: return Composition (
+        (number, count * coefficient)
+        for molecule, coefficient in self.molecules.items()
+        for number, count in molecule.elements.pairs()
+    )
+
+    def get_element_set (self) -> ["Element"]: 
+        """
+        Every element in any species on this side, by atomic number. Unlike 
+        `elements` this ignores the coefficients, so a coefficient of 0 does 
+        not hide an element. 
+        """
+        numbers = {number for molecule in self.molecules for number, _ in molecule.elements.pairs()}
+        return [BY_NUMBER [number] for number in sorted (numbers)]
+
+
+class Factorization: 
+    """
+    The Hermite normal form of [A^T | I] for a composition matrix A, kept up 
+    to date as species are added and removed. 
+
+    Every row is a combination of species: its element counts, then the 
+    weight of each species. `echelon` holds the rows in echelon form, and 
+    `kernel` the weights of the rows whose counts vanished, which span the 
+    integer nullspace of A. The kernel is kept in Hermite normal form too, so 
+    it is the same basis `Matrix.integer_nullspace` returns. An edit only 
+    has to fold one row in or out instead of reducing the whole matrix. 
+    """
+    def __init__(self, elements: ["Element"], columns: [{"Element": int}]): 
+        self.elements: ["Element"] = list (elements)
+        self.size = len (columns)
+        offset = len (self.elements)
+        rows = [
+            [column.get (element, 0) for element in self.elements] + 
+            [int (col == index) for index in range (self.size)]
+            for col, column in enumerate (columns)
+        ]
+        rank = hermite_normal_form (rows, offset)
+        self.echelon: [[int]] = rows [:rank]
+        self.kernel: [[int]] = [row [offset:] for row in rows [rank:]]
+        hermite_normal_form (self.kernel, self.size)
+
+    def nullspace(self) -> [[int]]: return [list (row) for row in self.kernel]
+
+    def insert(self, index: int, column: {"Element": int}) -> None: 
+        """Adds a species with the (signed) counts in `column` as column `index`."""
+        for element in column: 
+            if element in self.elements: continue
+            for row in self.echelon: row.insert (len (self.elements), 0)
+            self.elements.append (element)
+        offset = len (self.elements)
+        for row in self.echelon: row.insert (offset + index, 0)
+        for row in self.kernel: row.insert (index, 0)
+        self.size += 1
+
+        row = [column.get (element, 0) for element in self.elements] + [0] * self.size
+        row [offset + index] = 1
+        rows = self.echelon + [row]
+        rank = hermite_normal_form (rows, offset)
+        self.echelon = rows [:rank]
+        if rank < len (rows):  # the new species adds a free variable
+            self.kernel.append (rows [rank] [offset:])
+            hermite_normal_form (self.kernel, self.size)
+
+    def remove(self, index: int) -> None: 
+        """Removes the species in column `index`."""
+        offset = len (self.elements)
+        col = offset + index
+        # combine the kernel rows that use this species until only one does
+        using = [position for position, row in enumerate (self.kernel) if row [index]]
+        combined = [[self.kernel [position] [index]] + self.kernel [position] for position in using]
+        hermite_normal_form (combined, 1)
+        for position, row in zip (using, combined): self.kernel [position] = row [1:]
+
+        if using and all (row [col] % self.kernel [using [0]] [index] == 0 for row in self.echelon): 
+            # cancel the species out of the echelon rows with that kernel row, 
+            # which has no element counts, so they stay in echelon form
+            dropped = self.kernel.pop (using [0])
+            for row in self.echelon: 
+                quotient = row [col] // dropped [index]
+                if quotient: row [offset:] = [a - quotient * b for a, b in zip (row [offset:], dropped)]
+            for row in self.echelon: del row [col]
+            for row in self.kernel: del row [index]
+            self.size -= 1
+        else: 
+            # the species matters for the rank, so reduce everything again
+            rows = self.echelon + [[0] * offset + row for row in self.kernel]
+            using = [position for position, row in enumerate (rows) if row [col]]
+            combined = [[rows [position] [col]] + rows [position] for position in using]
+            hermite_normal_form (combined, 1)
+            for position, row in zip (using [1:], combined [1:]): rows [position] = row [1:]
+            del rows [using [0]]
+            for row in rows: del row [col]
+            self.size -= 1
+            rank = hermite_normal_form (rows, offset)
+            self.echelon = rows [:rank]
+            self.kernel = [row [offset:] for row in rows [rank:]]
+
+        # an element no species has anymore is all zeros
+        for col in reversed (range (offset)): 
+            if any (row [col] for row in self.echelon): continue
+            del self.elements [col]
+            for row in self.echelon: del row [col]
+        hermite_normal_form (self.kernel, self.size)
 
 
 class Equation: 
     def __init__(self, formula: str): 
-        sides: [str] = formula.split (" --> ")
-        self.left: Side = Side (sides [0])
-        self.right: Side = Side (sides [1])
+        sides: [[Species]] = parse_equation (formula)
+        if len (sides) != 2: raise SyntaxError (f"Expected exactly one --> in {formula}")
+        self.left: Side = Side (species = sides [0])
+        self.right: Side = Side (species = sides [1])
         self.verify()
-        self.matrix = self.get_matrix()
+        self.sparse_matrix = self.get_sparse_matrix()
+
+    @lazyattr
+    def matrix(self) -> Matrix: return self.get_matrix()
+
+    @lazyattr
+    def factorization(self) -> Factorization: 
+        return Factorization (self.sparse_matrix, self.get_columns())
 
     def __repr__(self): return f"Equation ({self})"
     def __str__(self): return f"{self.left} --> {self.right}"
 
-    def is_balanced(self): 
-        self.left.elements = self.left.get_elements()
-        self.right.elements = self.right.get_elements()
-        return self.left.elements == self.right.elements
+    def canonical(self) -> (str, [int]): 
+        """
+        Returns a key shared by every way of writing this reaction, and the 
+        matrix column of each species in key order. 
+
+        Species are written in Hill order and sorted within each side, so 
+        "O2 + H2 --> H2O" and "H2 + O2 --> OH2" get the same key. 
+        """
+        left = self.left.canonical()
+        offset = len (left)
+        right = [(formula, index + offset) for formula, index in self.right.canonical()]
+        key = " --> ".join (
+            " + ".join (formula for formula, _ in side) for side in (left, right)
+        )
+        return key, [index for _, index in left + right]
+
+    def get_species(self, formula: str) -> Species: 
+        sides = parse_equation (formula)
+        if len (sides) != 1 or len (sides [0]) != 1: 
+            raise SyntaxError (f"Expected a single species, not {formula}")
+        return sides [0] [0]
+
+    def find(self, formula: str) -> (Side, int, Species): 
+        """Returns the side a species is on, its matrix column, and the species itself."""
+        species = self.get_species (formula)
+        for side, offset in ((self.left, 0), (self.right, len (self.left.molecules))): 
+            if species in side.molecules: 
+                position = side.molecules_list.index (species)
+                return side, offset + position, side.molecules_list [position]
+        raise ValueError (f"{formula} is not in {self}")
+
+    def add_species(self, formula: str, side: str = "right") -> Species: 
+        """
+        Adds a species to the "left" or "right" side. Only the new species is 
+        parsed, and the factorization is updated rather than rebuilt, so 
+        rebalancing afterwards is cheap. 
+        """
+        if side not in ("left", "right"): raise ValueError (f"side must be 'left' or 'right', not {side!r}")
+        species = self.get_species (formula)
+        if species in self.left.molecules or species in self.right.molecules: 
+            raise ValueError (f"{formula} is already in {self}")
+        index = len (self.left.molecules) + (len (self.right.molecules) if side == "right" else 0)
+        getattr (self, side).add (species)
+        self.update (lambda factorization: factorization.insert (index, self.get_column (species, side)))
+        return species
+
+    def remove_species(self, formula: str) -> Species: 
+        """Removes a species from whichever side it is on."""
+        side, index, species = self.find (formula)
+        if len (side.molecules) == 1: raise ValueError (f"Cannot remove the last species from {side}")
+        side.remove (species)
+        self.update (lambda factorization: factorization.remove (index))
+        return species
+
+    def replace_species(self, old: str, new: str) -> Species: 
+        """Replaces the species `old` with `new`, in the same position."""
+        side, index, old = self.find (old)
+        species = self.get_species (new)
+        if species in self.left.molecules or species in self.right.molecules: 
+            raise ValueError (f"{new} is already in {self}")
+        side.replace (old, species)
+        name = "left" if side is self.left else "right"
+        def replace (factorization): 
+            factorization.remove (index)
+            factorization.insert (index, self.get_column (species, name))
+        self.update (replace)
+        return species
+
+    def update(self, edit) -> None: 
+        """Brings the matrices up to date after a species was edited."""
+        self.sparse_matrix = self.get_sparse_matrix()
+        self.__dict__.pop ("matrix", None)
+        if "factorization" in self.__dict__: edit (self.factorization)
+
+    def get_column(self, species: Species, side: str) -> {"Element": int}: 
+        """The counts of `species` in the composition matrix, negative for reactants."""
+        sign = -1 if side == "left" else 1
+        return {element: sign * count for element, count in species.elements.items()}
+
+    def get_columns(self) -> [{"Element": int}]: return [
+        *(self.get_column (species, "left") for species in self.left.molecules), 
+        *(self.get_column (species, "right") for species in self.right.molecules), 
+    ]
+
+    def get_coefficients(self) -> [int]: 
+        return [*self.left.molecules.values(), *self.right.molecules.values()]
+
+    def check(self, coefficients: [int]) -> bool: 
+        """Whether `coefficients` (in matrix column order) balance this equation."""
+        return not self.imbalance (coefficients)
+
+    def is_balanced(self) -> bool: return not self.imbalance()
+
+    def imbalance(self, coefficients: [int] = None) -> {"Element": int}: 
+        """
+        Returns how many more atoms of each element end up on the right than 
+        on the left, as the product of the composition matrix and 
+        `coefficients` (in matrix column order, the current ones by default). 
+        Balanced elements are left out, so a balanced equation gives {}. 
+        """
+        if coefficients is None: coefficients = self.get_coefficients()
+        imbalance = {}
+        for element, row in self.sparse_matrix.items(): 
+            total = sum (count * coefficients [col] for col, count in row.items())
+            if total: imbalance [element] = total
+        return imbalance
+
+    def imbalances(self, vectors: [[int]]) -> [{"Element": int}]: 
+        """
+        `imbalance` for many coefficient vectors at once. With NumPy this is 
+        one matrix product, unless the totals could overflow 64 bits. 
+        """
+        vectors = [list (vector) for vector in vectors]
+        if numpy is None or not vectors: return [self.imbalance (vector) for vector in vectors]
+        largest = max (abs (value) for vector in vectors for value in vector)
+        widest = max ((sum (map (abs, row.values())) for row in self.sparse_matrix.values()), default = 0)
+        if largest * widest > numpy.iinfo (numpy.int64).max: 
+            return [self.imbalance (vector) for vector in vectors]
+        elements = list (self.sparse_matrix)
+        totals = numpy.array (vectors, dtype = numpy.int64) @ numpy.array (
+            self.matrix.matrix, dtype = numpy.int64
+        ).T
+        return [
+            {elements [index]: int (row [index]) for index in numpy.flatnonzero (row)}
+            for row in totals
+        ]
 
     def verify(self) -> None: 
-        if (
-            any (
-                element not in self.right.elements
-                for element in self.left.elements
-            ) or any (
-                element not in self.left.elements
-                for element in self.right.elements
-            )
-        ): raise SyntaxError (f"There is an inconsistency in {self}")
+        if self.left.get_element_set() != self.right.get_element_set(): raise UnbalanceableError (f"There is an inconsistency in {self}")
+
+    def check_balanceable(self) -> None: 
+        """
+        Raises UnbalanceableError for equations that can be ruled out without 
+        any elimination: an element on only one side, which forces every 
+        species with it to 0, or a composition matrix with full column rank, 
+        which only allows all 0s. The rank is taken modulo a prime, which can 
+        only come out too low, so this never rejects a balanceable equation. 
+        """
+        for element, row in self.sparse_matrix.items(): 
+            if all (count > 0 for count in row.values()): side = "right"
+            elif all (count < 0 for count in row.values()): side = "left"
+            else: continue
+            raise UnbalanceableError (f"{element.symbol} only appears on the {side} of {self}")
+        cols = len (self.left.molecules) + len (self.right.molecules)
+        if len (self.sparse_matrix) < cols: return  # more unknowns than equations
+        _, pivots = modular_rref ([
+            [row.get (col, 0) for col in range (cols)] for row in self.sparse_matrix.values()
+        ], PRIMES [0])
+        if len (pivots) == cols: raise UnbalanceableError (f"Only zeros balance {self}")
 
+    def get_sparse_matrix(self) -> {"Element": {int: int}}: 
+        """Returns the composition matrix as {element: {species index: count}}, without the zeros."""
+        matrix = {element: {} for element in self.left.get_element_set()}
+        for index, molecule in enumerate (self.left.molecules): 
+            for element, count in molecule.elements.items(): 
+                matrix [element] [index] = -count
+        offset = len (self.left.molecules)
+        for index, molecule in enumerate (self.right.molecules, offset): 
+            for element, count in molecule.elements.items(): 
+                matrix.setdefault (element, {}) [index] = count  # only on the right while editing
+        return matrix
+
+    @timed
     def get_matrix(self) -> Matrix:
-        matrix = []
-        for element in self.left.elements: 
-            row = []
-            for molecule in self.left.molecules: 
-                if element in molecule.elements: 
-                    row.append (-molecule.elements [element])
-                else: row.append (0)
-            for molecule in self.right.molecules: 
-                if element in molecule.elements: 
-                    row.append (molecule.elements [element])
-                else: row.append (0)
-            matrix.append (row)
-        return Matrix (matrix)
+        cols = len (self.left.molecules) + len (self.right.molecules)
+        return Matrix ([
+            [row.get (col, 0) for col in range (cols)]
+            for row in self.sparse_matrix.values()
+        ])
 
     def set_coefficients(self, nullspace: Matrix): 
         for index in range (len (self.left.molecules)):
@@ -253,23 +1174,191 @@ class Equation:
         for index2 in range (len (self.right.molecules)):
             molecule = self.right.molecules_list [index2]
             self.right.molecules [molecule] = nullspace [index + index2 + 1]
+        self.left.__dict__.pop ("elements", None)
+        self.right.__dict__.pop ("elements", None)
+
+    @timed
+    def balance(self, solver = "hnf") -> None: 
+        if solver not in SOLVERS: 
+            raise ValueError (f"Unknown solver {solver!r}, expected one of {tuple (SOLVERS)}")
+        self.check_balanceable()
+        cols = len (self.left.molecules) + len (self.right.molecules)
+        if solver == "sparse":  # skip building the dense matrix
+            basis = sparse_nullspace (self.sparse_matrix.values(), cols)
+        elif solver == "hnf": basis = self.factorization.nullspace()  # kept up to date by edits
+        else: basis = SOLVERS [solver] (self.matrix)
+        # every vector in the basis balances the equation, so there is no need to check
+
+        # With more than one free variable the answer depends on the column 
+        # order, so pick it in canonical order, the same however the equation 
+        # is written and whether or not `balance` found it in the cache
+        _, order = self.canonical()
+        basis = [[vector [col] for col in order] for vector in basis]
+        rows = [
+            {position: row [col] for position, col in enumerate (order) if col in row}
+            for row in self.sparse_matrix.values()
+        ]
+        fallback = None
+        if len (basis) > 1:  # the search is slow to give up, so rule out infeasible equations first
+            fallback = positive_solution (rows, cols)
+        try: solution = choose_coefficients (basis)
+        except ValueError: solution = fallback or positive_solution (rows, cols)
+        coefficients = [0] * cols
+        for value, col in zip (solution, order): coefficients [col] = value
+        self.set_coefficients(coefficients)
+
+
+CACHE = LRUCache (maxsize = 1024)  # Equation.canonical key: coefficients in key order
+
+@timed
+def balance (
+    input_: str, 
+    use_cache: bool = True, 
+    timeout: float = None, 
+    max_species: int = None, 
+    max_length: int = None, 
+) -> Equation: 
+    """
+    Balances an equation given as a string, like "H2 + O2 --> H2O". 
+
+    Solutions are kept in `CACHE` under `Equation.canonical`, so the same 
+    reaction written in another order is only solved once. A cached solution
+    is mapped back to the order of `input_` and checked against the 
+    composition matrix before it is used. 
 
-    def balance(self) -> None: 
-        self.set_coefficients(self.matrix.nullspace())
-        if not self.is_balanced(): raise Exception (self)
+    Raises BudgetExceeded if `input_` is longer than `max_length` characters, 
+    has more than `max_species` species, or takes more than `timeout` seconds. 
+    The elimination checks the time as it goes, so it stops soon after. 
+    """
+    if max_length is not None and len (input_) > max_length: 
+        raise BudgetExceeded (f"{len (input_)} characters is over the limit of {max_length}")
+    with time_budget (timeout): 
+        equation: Equation = Equation (input_) 
+        species = len (equation.left.molecules) + len (equation.right.molecules)
+        if max_species is not None and species > max_species: 
+            raise BudgetExceeded (f"{species} species is over the limit of {max_species}")
+        if use_cache: 
+            key, order = equation.canonical()
+            cached = CACHE.get (key)
+            if cached is not None: 
+                coefficients = [0] * len (order)
+                for coefficient, col in zip (cached, order): coefficients [col] = coefficient
+                if equation.check (coefficients): 
+                    equation.set_coefficients (coefficients)
+                    return equation
+                else: CACHE.discard (key)
 
+        equation.balance()
+        if use_cache: 
+            coefficients = equation.get_coefficients()
+            CACHE.put (key, tuple (coefficients [col] for col in order))
+        return equation
 
-def balance (input_: str) -> Equation: 
-    equation: Equation = Equation (input_) 
-    equation.balance()
-    return equation
+# `coefficients` is in matrix column order, and `error` is None on success
+BalanceResult = namedtuple ("BalanceResult", "index input coefficients equation error")
+
+def balance_chunk (chunk: [(int, str)], budget: dict = None) -> [BalanceResult]: 
+    """
+    Balances (index, equation) pairs, recording errors instead of raising them. 
+    `budget` holds the timeout and size limits for `balance`. 
+    """
+    results = []
+    for index, input_ in chunk: 
+        try: equation = balance (input_, **(budget or {}))
+        except Exception as error: results.append (BalanceResult (
+            index, input_, None, None, f"{type (error).__name__}: {error}"
+        ))
+        else: results.append (BalanceResult (
+            index, input_, equation.get_coefficients(), str (equation), None
+        ))
+    return results
+
+def balance_many (
+    equations, 
+    jobs: int = None, 
+    chunksize: int = 64, 
+    ordered: bool = True, 
+    **budget
+) -> "Iterator[BalanceResult]": 
+    """
+    Balances many equations across `jobs` processes (default: one per core). 
+
+    Equations are sent to the workers `chunksize` at a time, and results are 
+    yielded as soon as they are ready: in input order, or in whatever order 
+    they finish if `ordered` is False. Only a few chunks per worker are in 
+    flight at once, so `equations` can be an arbitrarily long iterable. A bad 
+    equation gives a result with an `error` instead of stopping the batch. 
+
+    `budget` can set `timeout`, `max_species` and `max_length` for every 
+    equation (see `balance`). An equation over budget is given up on and 
+    reported with a BudgetExceeded error, and its worker moves on. 
+    """
+    if jobs is None: jobs = cpu_count() or 1
+    if jobs < 1 or chunksize < 1: raise ValueError ("jobs and chunksize must be at least 1")
+    numbered = enumerate (equations)
+    chunks = iter (lambda: list (islice (numbered, chunksize)), [])
+    if jobs == 1: 
+        for chunk in chunks: yield from balance_chunk (chunk, budget)
+        return
+
+    with ProcessPoolExecutor (max_workers = jobs) as pool: 
+        pending = deque (
+            pool.submit (balance_chunk, chunk, budget) for chunk in islice (chunks, jobs * 2)
+        )
+        while pending: 
+            if ordered: done = [pending.popleft()]
+            else: 
+                done, _ = wait (pending, return_when = FIRST_COMPLETED)
+                for future in done: pending.remove (future)
+            for future in done: 
+                chunk = next (chunks, None)
+                if chunk is not None: pending.append (pool.submit (balance_chunk, chunk, budget))
+                yield from future.result()
+
+def stream_jsonl (lines, output, **options) -> None: 
+    """
+    Balances one equation per line and writes one JSON record per line to 
+    `output`, as each result comes back. 
+
+    Records hold the line number, input, coefficients, balanced equation and 
+    error. Blank lines are skipped. `options` go to `balance_many`. 
+    """
+    equations = (line.strip() for line in lines)
+    for result in balance_many (equations, **options): 
+        if not result.input: continue
+        output.write (dumps ({
+            "line": result.index + 1, 
+            "input": result.input, 
+            "coefficients": result.coefficients, 
+            "equation": result.equation, 
+            "error": result.error,
+        }) + "\n")
 
 if __name__ == '__main__': 
-    # from argparse import ArgumentParser
-    # parser = ArgumentParser()
-    # parser.add_argument ("formula", nargs = "*", help = "Equation to balance")
-    # args = parser.parse_args()
-    # eq = args.formula [0]
-    eq = input("Enter a formula: ")
-    # print(f"Balancing {eq}")
-    print (balance (eq))
\ No newline at end of file
+    from argparse import ArgumentParser
+    import sys
+    parser = ArgumentParser (description = "Balances chemical equations")
+    parser.add_argument ("file", nargs = "?", help = "File with one equation per line (- for stdin). Results are written as JSON lines")
+    parser.add_argument ("--jobs", type = int, default = 1, help = "Worker processes (default: 1)")
+    parser.add_argument ("--chunk-size", type = int, default = 64, help = "Equations sent to a worker at a time (default: 64)")
+    parser.add_argument ("--unordered", action = "store_true", help = "Write results as they finish instead of in input order")
+    parser.add_argument ("--timeout", type = float, help = "Give up on an equation after this many seconds")
+    parser.add_argument ("--max-species", type = int, help = "Give up on equations with more species than this")
+    parser.add_argument ("--max-length", type = int, help = "Give up on lines longer than this many characters, before parsing them")
+    args = parser.parse_args()
+
+    if args.file is None and sys.stdin.isatty(): 
+        eq = input("Enter a formula: ")
+        print (balance (eq))
+    else: 
+        lines = sys.stdin if args.file in (None, "-") else open (args.file)
+        with lines: stream_jsonl (
+            lines, 
+            sys.stdout, 
+            jobs = args.jobs, 
+            chunksize = args.chunk_size, 
+            ordered = not args.unordered, 
+            timeout = args.timeout, 
+            max_species = args.max_species, 
+            max_length = args.max_length, 
+        )
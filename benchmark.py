@@ -0,0 +1,238 @@
+"""
+Benchmarks for the equation balancer.
+
+Run with `python benchmark.py` for readable timings. `--json FILE` runs the 
+stage suite and writes machine-readable results, and `--baseline FILE` 
+compares them with an earlier run to catch scaling regressions.
+"""
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from json import dump, load
+from platform import python_version
+from random import Random
+from timeit import timeit
+import sys
+
+from balance import Equation, Fraction, Matrix, RREF_METHODS, SOLVERS, numpy
+from chemicals import parse_formula, Molecule, COMPOSITIONS
+from generate import random_reaction
+from worksheet import WORKSHEET
+
+def bench_fraction (digits = (1, 2, 4, 8, 16, 32), number = 10_000) -> {int: float}:
+    """
+    Times building a Fraction whose numerator has the given number of digits.
+
+    The numerator and denominator share a factor, so every construction has
+    to simplify. The cost should stay flat as the numerator grows.
+    """
+    results = {}
+    for count in digits:
+        num = 7 * 10 ** count + 7
+        denom = 7 * 3
+        seconds = timeit (lambda: Fraction (num, denom), number = number)
+        results [count] = seconds / number
+    return results
+
+def composition_matrix (elements: int, species: int, seed = 0) -> Matrix: 
+    """
+    A random composition matrix, shaped like `Equation.get_matrix`. 
+
+    Every species holds a few elements, with reactants negated. 
+    """
+    random = Random (seed)
+    matrix = [[0] * species for _ in range (elements)]
+    for col in range (species): 
+        sign = -1 if col < species // 2 else 1
+        for row in random.sample (range (elements), min (3, elements)): 
+            matrix [row] [col] = sign * random.randint (1, 12)
+    return Matrix (matrix)
+
+def bench_rref (sizes = (4, 8, 12, 16), number = 3) -> {int: {str: float}}: 
+    """Times each `Matrix.rref` method on wide matrices (3 species per element)."""
+    results = {}
+    for elements in sizes: 
+        matrix = composition_matrix (elements, elements * 3)
+        results [elements] = {
+            method: timeit (lambda: matrix.rref (method), number = number) / number
+            for method in RREF_METHODS
+        }
+    return results
+
+def parse_with_molecules (equation: str) -> None: 
+    """How Side used to parse an equation: two full Molecules per species."""
+    for side in equation.split (" --> "): 
+        {
+            Molecule (molecule._base_molecule): molecule.coefficient
+            for molecule in map (Molecule, side.split (" + "))
+        }
+
+@contextmanager
+def uncached (): 
+    """Turns `chemicals.COMPOSITIONS` off, so parsing is timed and not cache lookups."""
+    maxsize = COMPOSITIONS.maxsize
+    COMPOSITIONS.maxsize = 0
+    try: yield
+    finally: COMPOSITIONS.maxsize = maxsize
+
+def bench_parsing (number = 20) -> {str: float}: 
+    """Times parsing the whole worksheet in `worksheet.py`, old and new way."""
+    with uncached(): return {
+        name: timeit (
+            lambda: [parse (equation) for equation in WORKSHEET], number = number
+        ) / number
+        for name, parse in (("Molecule", parse_with_molecules), ("Equation", Equation))
+    }
+
+MOLECULES = ("H2O", "NaCl", "CO2", "Fe2O3", "NH4NO3", "CuSO4", "Ca(OH)2", "KMnO4", "C6H12O6")
+
+def bench_molecules (formulas = MOLECULES, number = 1000) -> {str: float}: 
+    """
+    Times building a Molecule for each formula and reading only its 
+    composition, as balancing does, against also reading its mass, type and 
+    name, which every Molecule used to work out up front. 
+    """
+    def composition (): 
+        for formula in formulas: Molecule (formula).composition
+    def everything (): 
+        for formula in formulas: 
+            molecule = Molecule (formula)
+            molecule.english_elements, molecule.mass, molecule.type, molecule.name
+    return {
+        name: timeit (function, number = number) / number
+        for name, function in (("composition", composition), ("everything", everything))
+    }
+
+def polymer (depth: int, width: int) -> str: 
+    """A formula nested `depth` groups deep, with `width` CH2 units in each group."""
+    formula = "H"
+    for _ in range (depth): formula = f"({'CH2' * width}{formula})2"
+    return "CH3" + formula
+
+def bench_formulas (shapes = ((25, 10), (25, 40), (25, 100), (50, 100)), number = 5) -> {(int, int): (int, float)}: 
+    """
+    Times `parse_formula` on deeply nested polymers. Returns the length of 
+    each formula and the seconds per parse, which should grow linearly. 
+    """
+    results = {}
+    for depth, width in shapes: 
+        formula = polymer (depth, width)
+        results [depth, width] = len (formula), timeit (lambda: parse_formula (formula), number = number) / number
+    return results
+
+# A few elements that show up together in redox reactions
+REDOX_ELEMENTS = ("H", "O", "C", "N", "S", "P", "Cl", "K", "Na", "Ca", "Mn", "Fe", "Cu", "Zn", "Cr")
+
+def combustion (carbons: int) -> str: return f"C{carbons}H{2 * carbons + 2} + O2 --> CO2 + H2O"
+
+def suite_equations (): 
+    """Yields (family, size, equation) for every equation in the stage suite."""
+    for equation in WORKSHEET: 
+        yield "worksheet", len (Equation (equation).get_coefficients()), equation
+    for carbons in (1, 10, 100, 1000): yield "combustion", carbons, combustion (carbons)
+    for species in (5, 10, 20, 50, 100, 200): 
+        yield "random", species, random_reaction (
+            species, min (species, len (REDOX_ELEMENTS)), seed = species, symbols = REDOX_ELEMENTS
+        ).equation
+
+def time_stages (equation: str, solvers = tuple (SOLVERS), repeat = 3) -> {str: float}: 
+    """
+    Times each stage of balancing `equation` separately, taking the best of 
+    `repeat` runs. The nullspace is timed once per solver, as "nullspace[name]". 
+    Parsing is timed with the formula cache off, see `uncached`. 
+    """
+    def best (function): return min (timeit (function, number = 1) for _ in range (repeat))
+
+    with uncached(): timings = {"parse": best (lambda: Equation (equation))}
+    parsed = Equation (equation)
+    timings ["get_matrix"] = best (parsed.get_matrix)
+    matrix = parsed.get_matrix()
+    timings ["rref"] = best (lambda: matrix.rref ("bareiss"))
+    for solver in solvers: 
+        timings [f"nullspace[{solver}]"] = best (lambda: SOLVERS [solver] (matrix))
+    parsed.balance()
+    timings ["is_balanced"] = best (parsed.is_balanced)
+    return timings
+
+def run_suite (solvers = tuple (SOLVERS), repeat = 3) -> dict: 
+    """Runs `time_stages` over `suite_equations`, as one JSON-friendly dict."""
+    results = []
+    for family, size, equation in suite_equations(): 
+        for stage, seconds in time_stages (equation, solvers, repeat).items(): 
+            results.append ({
+                "family": family, 
+                "size": size, 
+                "equation": equation, 
+                "stage": stage, 
+                "seconds": seconds,
+            })
+    return {"python": python_version(), "numpy": numpy is not None, "results": results}
+
+def find_regressions (current: dict, baseline: dict, tolerance = 1.5, min_seconds = 1e-4) -> [dict]: 
+    """
+    Returns the results in `current` that are more than `tolerance` times 
+    slower than the same family, size and stage in `baseline`. Timings below 
+    `min_seconds` in both runs are too noisy to compare. 
+    """
+    def key (result): return result ["family"], result ["equation"], result ["stage"]
+    old = {key (result): result ["seconds"] for result in baseline ["results"]}
+    regressions = []
+    for result in current ["results"]: 
+        before = old.get (key (result))
+        if before is None or max (before, result ["seconds"]) < min_seconds: continue
+        if result ["seconds"] > before * tolerance: 
+            regressions.append (dict (result, baseline = before))
+    return regressions
+
+if __name__ == '__main__':
+    parser = ArgumentParser (description = "Benchmarks the equation balancer")
+    parser.add_argument ("--json", metavar = "FILE", help = "Write the stage suite to FILE as JSON (- for stdout)")
+    parser.add_argument ("--baseline", metavar = "FILE", help = "Compare the stage suite with an earlier --json run, and exit with 1 on regressions")
+    parser.add_argument ("--tolerance", type = float, default = 1.5, help = "How many times slower counts as a regression (default: 1.5)")
+    parser.add_argument ("--repeat", type = int, default = 3, help = "Runs per stage, the best one counts (default: 3)")
+    args = parser.parse_args()
+
+    if args.json is None and args.baseline is None: 
+        print ("Fraction construction (seconds per call):")
+        for count, seconds in bench_fraction().items():
+            print (f"\t{count:>3} digits: {seconds:.2e}")
+
+        print ("Matrix.rref on wide composition matrices (seconds per call):")
+        for elements, timings in bench_rref().items(): 
+            print (f"\t{elements:>3} x {elements * 3:<3} " + ", ".join (
+                f"{method}: {seconds:.2e}" for method, seconds in timings.items()
+            ))
+
+        print ("Parsing the worksheet (seconds per pass):")
+        for name, seconds in bench_parsing().items(): print (f"\t{name}: {seconds:.2e}")
+
+        print ("Building Molecules (seconds per pass):")
+        for name, seconds in bench_molecules().items(): print (f"\t{name}: {seconds:.2e}")
+
+        print ("Parsing nested formulas (seconds per call):")
+        for (depth, width), (length, seconds) in bench_formulas().items(): 
+            print (f"\t{length:>6} characters, {depth} deep: {seconds:.2e}")
+
+        print ("Balancing stages, generated families (seconds per call):")
+        for family, size, equation in suite_equations(): 
+            if family == "worksheet": continue
+            print (f"\t{family} {size:>4}: " + ", ".join (
+                f"{stage}: {seconds:.1e}" 
+                for stage, seconds in time_stages (equation, repeat = args.repeat).items()
+            ))
+        sys.exit()
+
+    suite = run_suite (repeat = args.repeat)
+    if args.json == "-": dump (suite, sys.stdout, indent = 1)
+    elif args.json is not None: 
+        with open (args.json, "w") as file: dump (suite, file, indent = 1)
+
+    if args.baseline is not None: 
+        with open (args.baseline) as file: baseline = load (file)
+        regressions = find_regressions (suite, baseline, args.tolerance)
+        for result in regressions: print (
+            f"{result ['family']} {result ['size']} {result ['stage']}: "
+            f"{result ['baseline']:.2e}s -> {result ['seconds']:.2e}s", 
+            file = sys.stderr
+        )
+        sys.exit (1 if regressions else 0)
@@ -0,0 +1,70 @@
+"""
+A small least-recently-used cache, shared by the modules that need one.
+"""
+
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    A dict-like cache that holds at most `maxsize` entries.
+
+    Looking up or storing a key marks it as most recently used, and storing a
+    new key when the cache is full evicts the least recently used one. Hits,
+    misses and evictions are counted, see `info`. A `maxsize` of 0 disables
+    the cache.
+    """
+    def __init__(self, maxsize: int = 1024):
+        if maxsize < 0: raise ValueError (f"maxsize must be at least 0, not {maxsize}")
+        self._maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __repr__(self): return f"LRUCache ({len (self)}/{self.maxsize})"
+    def __len__(self): return len (self.entries)
+    def __contains__(self, key): return key in self.entries
+
+    @property
+    def maxsize(self): return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize: int):
+        if maxsize < 0: raise ValueError (f"maxsize must be at least 0, not {maxsize}")
+        self._maxsize = maxsize
+        self.trim()
+
+    def get(self, key, default = None):
+        try: value = self.entries [key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end (key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value) -> None:
+        if not self.maxsize: return
+        self.entries [key] = value
+        self.entries.move_to_end (key)
+        self.trim()
+
+    def discard(self, key) -> None: self.entries.pop (key, None)
+
+    def trim(self) -> None:
+        while len (self.entries) > self.maxsize:
+            self.entries.popitem (last = False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len (self),
+            "maxsize": self.maxsize,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
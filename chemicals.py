@@ -1,15 +1,21 @@
 from argparse import ArgumentParser
+from array import array
 from collections import Counter
 from functools import reduce
 from operator import add 
 from textwrap import dedent
 
 from roman import convert as to_roman
-from elements import ELEMENTS as periodic_table
+from cache import LRUCache
+from elements import ELEMENTS as periodic_table, lazyattr
+from timing import timed
 from my_stuff.misc import pause, init
-from my_stuff.strs import find_closing_paren, consume_int
+from my_stuff.strs import consume_int
 from my_stuff.lists import VOWELS
 
+try: import numpy
+except ImportError: numpy = None  # molar_masses falls back to lists
+
 PREFIXES: {int, str} = {
 	1: "Mono",
 	2: "Di",
@@ -59,10 +65,6 @@ for symbol, base_name in (_flourine, _chlorine, _bromine, _iodine, _astatine):
 	POLYATOMIC_IONS [f"{symbol}O3"] = (f"{base_name.title()}ate", -1)
 	POLYATOMIC_IONS [f"{symbol}O4"] = (f"Per{base_name}ate", -1)
 
-args = ArgumentParser()
-args.add_argument ("formula", nargs = "?", help = "Formula to parse")
-args = vars (args.parse_args())
-
 def counter_mul (counter: Counter, mul: int):
 	for element in counter: counter [element] *= mul
 
@@ -76,6 +78,221 @@ def get_english_elements (elements: dict) -> dict:
 		raise KeyError (f"{invalid} is not on the periodic table!") from None
 	else: return english_elements
 
+def hill_formula (elements: dict) -> str:
+	"""
+	Writes a composition in Hill order: carbon, then hydrogen, then everything
+	else alphabetically. Without carbon, everything is alphabetical.
+	"""
+	symbols = {
+		(element if type (element) is str else element.symbol): count
+		for element, count in elements.items()
+	}
+	if "C" in symbols: 
+		order = ["C"] + (["H"] if "H" in symbols else []) + sorted (
+			symbol for symbol in symbols if symbol not in ("C", "H")
+		)
+	else: order = sorted (symbols)
+	return "".join (
+		f"{symbol}{symbols [symbol] if symbols [symbol] != 1 else ''}"
+		for symbol in order
+	)
+
+@timed
+def parse_formula (formula: str) -> Counter: 
+	"""
+	Counts the atoms in a formula like 2Al2(SO4)3, in one pass.
+
+	Every group in parentheses gets its own Counter on a stack, which is 
+	multiplied into the one below when the group closes, so the time is 
+	linear in the length of the formula however deep the nesting goes. A 
+	leading number multiplies everything. Errors give the position (from 1) 
+	of the character at fault.
+	"""
+	mul, index = consume_int (formula, 0)
+	stack: [Counter] = [Counter()]
+	opened: [int] = []  # where each open group starts
+	while index < len (formula): 
+		letter = formula [index]
+		if letter.isupper(): 
+			symbol = letter
+			index += 1
+			if index < len (formula) and formula [index].islower(): 
+				symbol += formula [index]
+				index += 1
+				if index < len (formula) and formula [index].islower(): 
+					raise ValueError (f"Cannot have two lowercase letters (letters {index} and {index + 1}) together: {formula}")
+			count, index = consume_int (formula, index)
+			stack [-1] [symbol] += 1 if count is None else count
+		elif letter == "(": 
+			stack.append (Counter())
+			opened.append (index)
+			index += 1
+		elif letter == ")": 
+			if not opened: raise ValueError (f"Unmatched ) at pos {index + 1}: {formula}")
+			start = opened.pop()
+			group = stack.pop()
+			if not group: raise ValueError (f"Empty parentheses at pos {start + 1}: {formula}")
+			count, index = consume_int (formula, index + 1)
+			for symbol, number in group.items(): 
+				stack [-1] [symbol] += number * (1 if count is None else count)
+		elif letter.islower(): 
+			raise ValueError (f"Caught an element that starts with a lowercase letter at pos {index + 1}: {formula}")
+		else: raise ValueError (f"{letter} at pos {index + 1} was unexpected: {formula}")
+
+	if opened: raise ValueError (f"Could not find a closing parenthesis for the one at pos {opened [-1] + 1}: {formula}")
+	elements = stack [0]
+	if mul is not None: counter_mul (elements, mul)
+	return elements
+
+BY_NUMBER: ("Element",) = (None, *periodic_table)  # so BY_NUMBER [1] is hydrogen
+
+def atomic_number (element) -> int: 
+	"""The atomic number of an Element, a symbol or a name."""
+	if type (element) is int: return element
+	if type (element) is str: return periodic_table [element].number
+	return element.number
+
+class Composition: 
+	"""
+	A read-only {Element: count}, like H2O -> {H: 2, O: 1}. 
+
+	The counts are kept as (atomic number, count) pairs, sorted by atomic 
+	number and packed into one array, and the hash is worked out once, so 
+	millions of these stay small and make fast dict keys. Compositions can be 
+	added, subtracted and multiplied by an int. Counts that come out 0 are 
+	dropped, so equal compositions always have equal pairs. 
+	"""
+	__slots__ = ("data", "_hash")
+
+	def __init__ (self, counts: "{Element: int} | [(int, int)]" = ()): 
+		totals: {int: int} = {}
+		for element, count in (counts.items() if hasattr (counts, "items") else counts): 
+			number = element if type (element) is int else atomic_number (element)
+			totals [number] = totals.get (number, 0) + count
+		self.data = array ("q", [
+			value for number in sorted (totals) if totals [number]
+			for value in (number, totals [number])
+		])
+		self._hash = hash (self.data.tobytes())
+
+	def __repr__ (self): return f"Composition ({hill_formula (self)})"
+	def __len__ (self): return len (self.data) // 2
+	def __iter__ (self): return iter (self.keys())
+	def __hash__ (self): return self._hash
+	def __eq__ (self, other): return (
+		type (other) is Composition and self._hash == other._hash and self.data == other.data
+	)
+
+	def find (self, element) -> int: 
+		"""The index of `element`'s count in `data`, or -1 if it is not there."""
+		try: return 2 * self.data [::2].index (atomic_number (element)) + 1
+		except ValueError: return -1  # at most 118 elements, so a scan is fine
+
+	def __contains__ (self, element): return self.find (element) != -1
+	def __getitem__ (self, element) -> int: 
+		index = self.find (element)
+		if index == -1: raise KeyError (element)
+		return self.data [index]
+
+	def get (self, element, default = None): 
+		index = self.find (element)
+		return default if index == -1 else self.data [index]
+
+	def pairs (self) -> "Iterator[(int, int)]": return zip (self.data [::2], self.data [1::2])
+	def keys (self) -> ["Element"]: return [BY_NUMBER [number] for number in self.data [::2]]
+	def values (self) -> [int]: return self.data [1::2].tolist()
+	def items (self) -> [("Element", int)]: return [
+		(BY_NUMBER [number], count) for number, count in self.pairs()
+	]
+
+	def __add__ (self, other): 
+		if type (other) is not Composition: return NotImplemented
+		return Composition ([*self.pairs(), *other.pairs()])
+
+	def __sub__ (self, other): 
+		if type (other) is not Composition: return NotImplemented
+		return self + other * -1
+
+	def __mul__ (self, factor: int): 
+		if type (factor) is not int: return NotImplemented
+		return Composition ((number, count * factor) for number, count in self.pairs())
+
+	__rmul__ = __mul__
+
+# formula: its Composition, see get_composition
+COMPOSITIONS = LRUCache (maxsize = 4096)
+
+def make_composition (formula: str, counts: {str: int}) -> Composition: 
+	"""
+	Looks up the symbols in {symbol: count} on the periodic table and stores 
+	the result in `COMPOSITIONS` as the composition of `formula`. 
+	"""
+	for symbol in counts: 
+		if symbol not in periodic_table: 
+			raise ValueError (f"{symbol} is not on the periodic table: {formula}")
+	composition = Composition (counts)
+	COMPOSITIONS.put (formula, composition)
+	return composition
+
+@timed
+def get_composition (formula: str) -> Composition: 
+	"""
+	Returns the Composition of `formula`. 
+
+	Compositions are shared through `COMPOSITIONS` by every Molecule and by 
+	balance.py, so a formula that keeps coming up is only parsed once. 
+	`COMPOSITIONS.info()` has the hit rate. 
+	"""
+	composition = COMPOSITIONS.get (formula)
+	if composition is None: composition = make_composition (formula, parse_formula (formula))
+	return composition
+
+MASSES: "numpy.ndarray" = None if numpy is None else numpy.array (
+	[float ("nan")] + [element.mass for element in periodic_table]
+)  # by atomic number
+
+@timed
+def molar_masses (formulas: [str]) -> ("numpy.ndarray", "numpy.ndarray"): 
+	"""
+	Returns the molar mass of every formula, and whether it was invalid. 
+
+	Each distinct formula is parsed once, and all of their compositions go 
+	into one sparse matrix of counts, as (row, atomic number, count) triples, 
+	which is multiplied by `MASSES` in one go. Invalid formulas get a mass of 
+	NaN and True in the errors. The results are float64 and bool arrays, or 
+	lists without NumPy. 
+	"""
+	distinct: {str: int} = {}  # formula: its row in the count matrix
+	order: [int] = [distinct.setdefault (formula, len (distinct)) for formula in formulas]
+	rows, numbers, counts = array ("q"), array ("q"), array ("q")
+	errors = []
+	for row, formula in enumerate (distinct): 
+		try: composition = get_composition (formula)
+		except (ValueError, TypeError, OverflowError): composition = None
+		errors.append (not composition)
+		if not composition: continue
+		rows.extend (array ("q", [row]) * len (composition))
+		numbers.extend (composition.data [::2])
+		counts.extend (composition.data [1::2])
+
+	if numpy is None: 
+		masses = [0.0] * len (errors)
+		for row, number, count in zip (rows, numbers, counts): 
+			masses [row] += periodic_table [number].mass * count
+		return (
+			[float ("nan") if errors [row] else masses [row] for row in order], 
+			[errors [row] for row in order], 
+		)
+	errors = numpy.array (errors, dtype = bool)
+	masses = numpy.bincount (
+		numpy.frombuffer (rows, dtype = numpy.int64), 
+		weights = MASSES [numpy.frombuffer (numbers, dtype = numpy.int64)] * numpy.frombuffer (counts, dtype = numpy.int64), 
+		minlength = len (errors), 
+	).astype (numpy.float64, copy = False)  # bincount gives ints when there is nothing to count
+	masses [errors] = numpy.nan
+	order = numpy.array (order, dtype = numpy.intp)
+	return masses [order], errors [order]
+
 def get_gen_index (generator, index: int):
 	tup = tuple (generator)
 	return tup [index]
@@ -83,25 +300,43 @@ def get_gen_index (generator, index: int):
 class Molecule:
 	@init
 	def __init__ (self, formula): 
-		self.elements = {
-			periodic_table [name]: count 
-			for name, count in self.get_elements().items()
-		}
-		# self.english_elements: dict = get_english_elements (self.elements)
-		self.english_elements:dict = {
-			element.name: count 
-			for element, count in self.elements.items()
-		}
-		self.elements_list: tuple = tuple (self.elements.keys())
-		self.refined_formula = self.refine_formula()
-		self.mass: int = self.get_mass()
-		# self.ionic: bool = self.get_ionic()
-		self.type: str = self.get_type()
-		self.name: str = self.get_name()
+		self.composition: Composition = get_composition (self.formula)
 		self.coefficient, index = consume_int (self.formula, 0)
 		if self.coefficient is None: self.coefficient = 1
 		self._base_molecule = self.formula [index:]
 
+	# Everything else is worked out on first use, so Molecules that are only 
+	# needed for their composition never pay for naming them
+	@lazyattr
+	def elements (self) -> dict: 
+		# in the order the formula has them, which naming goes by
+		return {periodic_table [name]: count for name, count in self.get_elements().items()}
+
+	@lazyattr
+	def elements_list (self) -> tuple: return tuple (self.elements.keys())
+
+	@lazyattr
+	def hill_formula (self) -> str: return hill_formula (self.composition)
+
+	@lazyattr
+	def english_elements (self) -> dict: 
+		# return get_english_elements (self.elements)
+		return {element.name: count for element, count in self.elements.items()}
+
+	@lazyattr
+	def refined_formula (self) -> str: return self.refine_formula()
+
+	@lazyattr
+	def mass (self) -> int: return self.get_mass()
+
+	# @lazyattr
+	# def ionic (self) -> bool: return self.get_ionic()
+
+	@lazyattr
+	def type (self) -> str: return self.get_type()
+
+	@lazyattr
+	def name (self) -> str: return self.get_name()
 
 	def __str__(self): return dedent (f"""
 		Molecule ({self.formula}):
@@ -116,70 +351,15 @@ class Molecule:
 	def __eq__(self, other): return type (other) is Molecule and self.formula == other.formula
 	def __hash__(self): return hash (self.formula)
 
-	def get_elements (self, formula = None):
-		if formula is None: formula = self.formula
-		last_element = ""
-		last_num = None
-		elements = Counter()
-		sub_elements = Counter()
-		skips = []
-		mul = 1
-		open_paren_index = -1 # -1 + 1 = 0
-		# handle nested parens
-		for _ in range (formula.count ("(")):
-			open_paren_index = formula.find ("(", open_paren_index + 1)
-			if open_paren_index in skips: continue
-			elif open_paren_index != -1: 
-				close_paren_index = find_closing_paren (formula, open_paren_index)
-				if close_paren_index is None: 
-					raise ValueError (f"Could not find closing parenthesis for the {_} opening parenthesis -- {formula}")
-				new_elements: Counter = self.get_elements (
-					formula [open_paren_index + 1:close_paren_index]
-				)
-				# find coefficient
-				temp_mul, index = consume_int (formula, close_paren_index + 1)
-				if temp_mul is None: temp_mul = 1
-				counter_mul (new_elements, temp_mul)
-				# prep
-				skips.extend (range (open_paren_index, index))
-				sub_elements += new_elements
-			else: raise ValueError (f"ERROR: Please tell Levi you got this error with this chemical formula: {formula}")
-
-		# parse the formula
-		for index, letter in enumerate (formula):
-			if index in skips: continue
-			elif index == 0 and letter.isdigit(): 
-				mul, end_index = consume_int (formula, 0)
-				skips.extend (range (end_index))
-				continue
-			elif letter.islower(): 
-				if not last_element: #starts with a lowercase?!
-					raise ValueError (f"Caught an element that starts with a lowercase letter: {formula}")
-				elif last_element [-1].islower(): #already a lowercase letter in the last element!
-					raise ValueError (f"Cannot have two lowercase letters (letters {index} and {index + 1}) together: {formula}")
-				else: last_element += letter
-			elif letter.isupper():
-				if last_element: elements [last_element] += 1 if last_num is None else last_num
-
-				last_element = letter
-				last_num = None
-			elif letter.isdigit(): # subscripts
-				if last_num is None: last_num = int (letter)
-				else: last_num = int (str (last_num) + letter)
-			else: raise ValueError (f"{letter} at pos {index + 1} was unexpected: {formula}")
-
-		# cleanup
-		if last_element: 
-			elements [last_element] += last_num if last_num is not None else 1
-
-		if sub_elements is not None: elements += sub_elements # add paren contents
-		counter_mul (elements, mul) # distribute coefficient
-		return elements
+	@timed
+	def get_elements (self, formula = None) -> Counter: 
+		return parse_formula (self.formula if formula is None else formula)
 
+	@timed
 	def get_mass (self): return reduce (add, 
 		(
 			element.mass * count
-			for element, count in self.elements.items()
+			for element, count in self.composition.items()
 		)
 	)
 
@@ -197,6 +377,7 @@ class Molecule:
 			return "ionic"
 		else: return "molecular"
 
+	@timed
 	def get_name (self):
 		if self.type == "molecular": return self.name_molecular()
 		elif self.type == "ionic": return self.name_ionic()
@@ -381,6 +562,9 @@ def get_base_name (name: str) -> str:
 
 
 if __name__ == "__main__":
+	args = ArgumentParser()
+	args.add_argument ("formula", nargs = "?", help = "Formula to parse")
+	args = vars (args.parse_args())
 	if not args ["formula"]: # we were double clicked!
 		formula:str = input ("What is the chemical formula? ")
 		should_pause:bool = True
@@ -0,0 +1,169 @@
+"""
+Generates random equations that are guaranteed to balance, for load and fuzz
+testing `balance.py`.
+
+Every reaction comes with the coefficients it was built from, so solvers can
+be checked against a known answer:
+
+>>> from balance import balance
+>>> reaction = random_reaction (species = 4, elements = 3, seed = 1)
+>>> balance (reaction.equation).get_coefficients() == reaction.coefficients
+True
+
+Run with `python generate.py` to print a corpus as JSON lines.
+"""
+
+from collections import namedtuple
+from math import gcd
+from random import Random
+
+from balance import divide_gcd, sparse_nullspace, Equation
+from elements import ELEMENTS
+
+SYMBOLS: (str,) = tuple (element.symbol for element in ELEMENTS)
+
+# `coefficients` balance `equation`. If `unique` is True, the equation has only
+# one solution, so these are its minimal coefficients.
+Reaction = namedtuple ("Reaction", "equation coefficients unique")
+
+def write_formula (composition: {str: int}, random: Random = None, groups: float = 0) -> str:
+    """
+    Writes a composition as a formula, like {"Ca": 3, "P": 2, "O": 8} -> Ca3P2O8.
+
+    With probability `groups`, two or more elements whose counts share a factor
+    are pulled into a parenthesized group instead, like Ca3(PO4)2.
+    """
+    def write (part): return "".join (
+        f"{symbol}{count if count != 1 else ''}" for symbol, count in part.items()
+    )
+
+    if random is None or len (composition) < 2 or random.random() >= groups:
+        return write (composition)
+    symbols = random.sample (list (composition), random.randint (2, len (composition)))
+    factor = 0
+    for symbol in symbols: factor = gcd (factor, composition [symbol])
+    if factor < 2: return write (composition)
+    outside = {symbol: count for symbol, count in composition.items() if symbol not in symbols}
+    group = {symbol: composition [symbol] // factor for symbol in symbols}
+    return f"{write (outside)}({write (group)}){factor}"
+
+def random_composition (random: Random, symbols: [str], max_elements: int, max_count: int) -> {str: int}:
+    return {
+        symbol: random.randint (1, max_count)
+        for symbol in random.sample (symbols, random.randint (1, min (max_elements, len (symbols))))
+    }
+
+def random_reaction (
+    species: int = 4,
+    elements: int = 3,
+    seed = None,
+    symbols: [str] = SYMBOLS,
+    max_count: int = 4,
+    max_coefficient: int = 6,
+    groups: float = 0.25,
+    attempts: int = 100,
+) -> Reaction:
+    """
+    Builds a random equation with `species` species made of `elements`
+    elements, picked from `symbols`.
+
+    Reactants get random compositions and coefficients, then the atoms they
+    add up to are dealt out among the products. The last product takes
+    whatever is left. Raises ValueError if `attempts` tries all gave
+    duplicate species or an empty product.
+    """
+    if species < 2: raise ValueError ("An equation needs at least 2 species")
+    if not 1 <= elements <= len (symbols): raise ValueError (f"Cannot use {elements} elements")
+    random = Random (seed)
+    for _ in range (attempts):
+        chosen = random.sample (symbols, elements)
+        seen = set()
+        def distinct (composition) -> bool:
+            key = frozenset (composition.items())
+            if key in seen: return False
+            seen.add (key)
+            return True
+
+        reactants = []
+        for _ in range (attempts * species):
+            if len (reactants) == max (1, species // 2): break
+            composition = random_composition (random, chosen, 3, max_count)
+            if distinct (composition): reactants.append (composition)
+        # make sure every chosen element shows up on the left
+        for index, symbol in enumerate (chosen):
+            if not any (symbol in composition for composition in reactants):
+                reactants [index % len (reactants)] [symbol] = random.randint (1, max_count)
+        if species == 2:  # A --> B only balances when A's counts share a factor, like O6 --> O2
+            factor = random.randint (2, max (2, max_count))
+            reactants [0] = {symbol: count * factor for symbol, count in reactants [0].items()}
+        seen = {frozenset (composition.items()) for composition in reactants}
+        if len (seen) < len (reactants): continue
+        coefficients = [random.randint (1, max_coefficient) for _ in reactants]
+
+        atoms = dict.fromkeys (chosen, 0)
+        for composition, coefficient in zip (reactants, coefficients):
+            for symbol, count in composition.items(): atoms [symbol] += coefficient * count
+
+        products = []
+        for _ in range (attempts * species):
+            if len (products) == species - len (reactants) - 1: break
+            available = [symbol for symbol, count in atoms.items() if count]
+            if not available: break
+            # spread what is left over the products still to come
+            share = species - len (reactants) - len (products)
+            coefficient = random.randint (1, max_coefficient)
+            composition = {
+                symbol: random.randint (1, max (1, atoms [symbol] // (coefficient * share)))
+                for symbol in random.sample (available, random.randint (1, min (3, len (available))))
+                if atoms [symbol] >= coefficient
+            }
+            if not composition or not distinct (composition): continue
+            for symbol, count in composition.items(): atoms [symbol] -= coefficient * count
+            products.append (composition)
+            coefficients.append (coefficient)
+
+        rest = {symbol: count for symbol, count in atoms.items() if count}
+        if not rest: continue
+        factor = 0
+        for count in rest.values(): factor = gcd (factor, count)
+        last = {symbol: count // factor for symbol, count in rest.items()}
+        if not distinct (last): continue
+        products.append (last)
+        coefficients.append (factor)
+
+        left = [write_formula (composition, random, groups) for composition in reactants]
+        right = [write_formula (composition, random, groups) for composition in products]
+        equation = f"{' + '.join (left)} --> {' + '.join (right)}"
+        parsed = Equation (equation)
+        if len (parsed.get_coefficients()) != species: continue  # ran out of distinct species
+        unique = len (sparse_nullspace (parsed.sparse_matrix.values(), species)) == 1
+        return Reaction (equation, divide_gcd (coefficients), unique)
+    raise ValueError (f"Could not generate a reaction in {attempts} attempts")
+
+def corpus (count: int, seed = 0, species = (2, 8), elements = (2, 6), **options) -> "Iterator[Reaction]":
+    """
+    Yields `count` random reactions, the same ones every time for the same
+    `seed`. Species and element counts are drawn from the inclusive ranges
+    `species` and `elements`. `options` go to `random_reaction`.
+    """
+    random = Random (seed)
+    for _ in range (count):
+        yield random_reaction (
+            species = random.randint (*species),
+            elements = random.randint (*elements),
+            seed = random.getrandbits (64),
+            **options
+        )
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    from json import dumps
+    parser = ArgumentParser (description = "Prints random balanceable equations as JSON lines")
+    parser.add_argument ("count", type = int, help = "How many equations to generate")
+    parser.add_argument ("--seed", type = int, default = 0, help = "Seed for a reproducible corpus (default: 0)")
+    parser.add_argument ("--species", type = int, nargs = 2, default = (2, 8), metavar = ("MIN", "MAX"), help = "Species per equation")
+    parser.add_argument ("--elements", type = int, nargs = 2, default = (2, 6), metavar = ("MIN", "MAX"), help = "Elements per equation")
+    parser.add_argument ("--groups", type = float, default = 0.25, help = "Chance of writing a parenthesized group (default: 0.25)")
+    args = parser.parse_args()
+    for reaction in corpus (args.count, args.seed, args.species, args.elements, groups = args.groups):
+        print (dumps (reaction._asdict()))
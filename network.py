@@ -0,0 +1,104 @@
+"""
+Networks of many reactions, analyzed together through their stoichiometric
+matrix: one row per species, one column per reaction, holding how much of
+the species the reaction makes (negative if it uses it up).
+
+>>> network = ReactionNetwork ([
+...     "2H2 + O2 --> 2H2O",
+...     "H2O2 --> H2 + O2",
+...     "2H2O2 --> 2H2O + O2",
+... ])
+>>> network.dependent_reactions()  # the first one is the third minus twice the second
+{0: {1: -(2/1), 2: (1/1)}}
+>>> network.conserved_moieties()  # hydrogen and oxygen atoms
+[{'H2': 1, 'H2O': 1, 'H2O2': 1}, {'O2': 2, 'H2O': 1, 'H2O2': 2}]
+
+The elimination is sparse (see `balance.sparse_rref`), so networks with
+thousands of species are fine. Which reactions count as the dependent ones
+is up to the elimination, which picks pivots to keep the matrix sparse.
+"""
+
+from balance import sparse_kernel, sparse_rref, Equation, Fraction, Matrix, Species
+
+class ReactionNetwork:
+    """
+    A set of reactions over a shared set of species.
+
+    Species are matched by formula, as written, so isomers like C2H5OH and
+    CH3OCH3 get rows of their own (and so would H2O and OH2). Reactions are
+    used as written, coefficients included, unless added with
+    `balance = True`.
+    """
+    def __init__(self, reactions: ["Equation | str"] = (), balance: bool = False):
+        self.reactions: [Equation] = []
+        self.species: {Species: int} = {}  # species: row
+        self.columns: [{int: int}] = []  # per reaction, {row: net coefficient}
+        for reaction in reactions: self.add (reaction, balance)
+
+    def __repr__(self): return f"ReactionNetwork ({len (self.species)} species, {len (self)} reactions)"
+    def __len__(self): return len (self.reactions)
+
+    def add(self, reaction: "Equation | str", balance: bool = False) -> int:
+        """Adds a reaction, as an Equation or a formula, and returns its column."""
+        if isinstance (reaction, str): reaction = Equation (reaction)
+        if balance: reaction.balance()
+        column = {}
+        for side, sign in ((reaction.left, -1), (reaction.right, 1)):
+            for species, coefficient in side.molecules.items():
+                row = self.species.setdefault (species, len (self.species))
+                column [row] = column.get (row, 0) + sign * coefficient
+        self.reactions.append (reaction)
+        self.columns.append ({row: value for row, value in column.items() if value})
+        return len (self.columns) - 1
+
+    def get_formulas(self) -> [str]: return [species.formula for species in self.species]
+
+    def get_rows(self) -> [{int: int}]:
+        """The stoichiometric matrix, as {reaction: net coefficient} per species."""
+        rows = [{} for _ in self.species]
+        for col, column in enumerate (self.columns):
+            for row, value in column.items(): rows [row] [col] = value
+        return rows
+
+    def stoichiometric_matrix(self) -> Matrix:
+        return Matrix ([
+            [row.get (col, 0) for col in range (len (self.columns))]
+            for row in self.get_rows()
+        ])
+
+    def conserved_moieties(self) -> [{str: int}]:
+        """
+        Returns a basis for the left nullspace of the stoichiometric matrix:
+        weights per species whose total no reaction changes. Every element
+        gives one, and so does any group of atoms that always moves together.
+        """
+        formulas = self.get_formulas()
+        return [
+            {formulas [row]: weight for row, weight in sorted (vector.items())}
+            for vector in sparse_kernel (self.columns, len (self.species))
+        ]
+
+    def dependent_reactions(self) -> {int: {int: Fraction}}:
+        """
+        Finds the reactions that are combinations of the others, with a single
+        elimination of the stoichiometric matrix. Returns
+        {reaction: {independent reaction: multiple}}, so reaction `i` is the
+        sum of `multiple` times each independent one.
+        """
+        rows, pivots, col_rows = sparse_rref (self.get_rows())
+        pivot_cols = set (pivots.values())
+        dependent = {}
+        for col in range (len (self.columns)):
+            if col in pivot_cols: continue
+            uses = sorted ((pivots [index], index) for index in col_rows.get (col, ()) if index in pivots)
+            dependent [col] = {
+                pivot_col: Fraction (rows [index] [col], rows [index] [pivot_col])
+                for pivot_col, index in uses
+            }
+        return dependent
+
+    def independent_reactions(self) -> [int]:
+        dependent = self.dependent_reactions()
+        return [col for col in range (len (self.columns)) if col not in dependent]
+
+    def rank(self) -> int: return len (self.independent_reactions())
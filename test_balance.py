@@ -1,4 +1,15 @@
-from balance import balance, Equation
+from functools import reduce
+from io import StringIO
+from json import loads
+from math import gcd
+
+from balance import balance, balance_many, expand_fractions, parse_equation, stream_jsonl, lcm, Equation, Fraction, Matrix, BudgetExceeded, UnbalanceableError, CACHE, PRIMES, SOLVERS
+from cache import LRUCache
+from chemicals import Molecule, COMPOSITIONS
+from generate import corpus, random_reaction
+from network import ReactionNetwork
+from worksheet import WORKSHEET
+import timing
 
 def test_parity_rule(): 
 	assert Equation ("3N2 + 3H2O --> 2NH3 + 3NO")
@@ -6,44 +17,333 @@ def test_parity_rule():
 def test_quiz_question(): 
 	assert balance ("N2 + H2O --> NH3 + NO")
 
-def test_worksheet(): 
-	equations: [str] = [
-		"H2 + O2 --> H2O",
-		"N2 + H2 --> NH3",
-		"S8 + O2 --> SO3",
-		"N2 + O2 --> N2O",
-		"HgO --> Hg + O2",
-		"CO2 + H2O --> C6H12O6 + O2",
-		"Zn + HCl --> ZnCl2 + H2",
-		"SiCl4 + H2O --> H4SiO4 + HCl",
-		"Na + H2O --> NaOH + H2",
-		"H3PO4 --> H4P2O7 + H2O",
-		"C10H16 + Cl2 --> C + HCl",
-		"CO2 + NH3 --> OC(NH2)2 + H2O",
-		"Si2H3 + O2 --> SiO2 + H2O3",
-		"Al(OH)3 + H2SO4 --> Al2(SO4)3 + H2O",
-		"Fe + O2 --> Fe2O3",
-		"Fe2(SO4)3 + KOH --> K2SO4 + Fe(OH)3",
-		"C7H6O2 + O2 --> CO + H2O",
-		"H2SO4 + HI --> H2S + I2 + H2O",
-		"FeS2 + O2 --> Fe2O3 + SO2",
-		"Al + FeO --> Al2O3 + Fe",
-		"Fe2O3 + H2 --> Fe + H2O",
-		"Na2CO3 + HCl --> NaCl + H2O + CO2",
-		"K + Br2 --> KBr",
-		"C7H16 + O2 --> CO2 + H2O",
-		"P4 + O2 --> P2O5",
-		"C2H2 + O2 --> CO2 + H2O",
-		"K2O + H2O --> KOH",
-		"H2O2 --> H2O + O2",
-		'Al + O2 --> Al2O3',
-		'Na2O2 + H2O --> NaOH + O2',
-		'SiO2 + HF --> SiF4 + H2O',
-		'C + O2 --> CO',
-		'KClO3 --> KCl + O2',
-		'KClO3 --> KClO4 + KCl'
+def test_zero_coefficient(): 
+	# a written coefficient of 0 must not hide the species' elements
+	assert str (balance ("0H2 + O2 --> H2O", use_cache = False)) == "2H2 + O2 --> 2H2O"
+
+def test_fraction(): 
+	assert Fraction (6, -4) == Fraction (-3, 2)
+	assert Fraction (1, 3) + Fraction (1, 6) == Fraction (1, 2)
+	assert Fraction (3, 4) - 1 == Fraction (-1, 4)
+	assert 2 * Fraction (3, 4) / Fraction (3, 2) == 1
+	assert Fraction (0, 5) == 0 and Fraction (0, 5).denom == 1
+	assert Fraction (-1, 2) < Fraction (1, 3) <= Fraction (2, 6)
+	assert hash (Fraction (4, 2)) == hash (2)
+	assert Fraction (10 ** 30, 10 ** 29) == 10
+
+def test_rref_methods(): 
+	matrix = Matrix ([
+		[-2, 0, 2, 0],
+		[0, -2, 1, 1],
+		[4, -6, 0, 3],
+	])
+	assert matrix.rref ("bareiss") == matrix.rref ("rational")
+	for method in ("bareiss", "rational"): 
+		try: Matrix ([[1, 0.5], [2, 3]]).rref (method)
+		except TypeError as error: assert "0.5 (float)" in str (error)
+		else: raise AssertionError (f"The {method} rref should reject floats")
+
+def test_integer_nullspace(): 
+	matrix = Equation ("H2 + O2 --> H2O + H2O2").matrix
+	basis = matrix.integer_nullspace()
+	assert len (basis) == 2
+	for vector in basis: 
+		assert not any (sum (a * b for a, b in zip (row, vector)) for row in matrix)
+
+def test_multiple_free_variables(): 
+	eq = balance ("CH4 + O2 --> CO2 + CO + H2O")
+	assert eq.is_balanced()
+	matrix = Equation ("CH4 + O2 --> CO2 + CO + H2O").matrix
+	vector = matrix.nullspace()
+	assert all (value > 0 for value in vector) and not any (sum (a * b for a, b in zip (row, vector)) for row in matrix)
+	assert all (count > 0 for count in eq.left.molecules.values())
+	assert all (count > 0 for count in eq.right.molecules.values())
+
+def test_lcm(): 
+	assert lcm ([Fraction (1, 2), Fraction (1, 3), Fraction (5, 4)]) == 12
+	assert lcm ([Fraction (1, 999_983), Fraction (1, 1_000_003)]) == 999_983 * 1_000_003
+	assert expand_fractions ([Fraction (2, 3), Fraction (4, 3), Fraction (2, 1)]) == [1, 2, 3]
+
+def test_minimal_coefficients(): 
+	for equation in WORKSHEET: 
+		hnf = Equation (equation)
+		hnf.balance ("hnf")
+		coefficients = [
+			*hnf.left.molecules.values(), 
+			*hnf.right.molecules.values()
+		]
+		assert reduce (gcd, coefficients) == 1, equation
+		for solver in SOLVERS: 
+			other = Equation (equation)
+			other.balance (solver)
+			assert str (hnf) == str (other), (equation, solver)
+
+def test_modular_nullspace(): 
+	matrix = Equation ("C1000H2002 + O2 --> CO2 + H2O").matrix
+	assert matrix.modular_nullspace() == matrix.integer_nullspace()
+	assert matrix.modular_nullspace (primes = PRIMES [:1]) == matrix.integer_nullspace()
+	assert matrix.modular_nullspace (primes = ()) == matrix.integer_nullspace()  # falls back
+
+def test_numpy_nullspace(): 
+	matrix = Equation ("C1000H2002 + O2 --> CO2 + H2O").matrix
+	assert matrix.numpy_nullspace() == matrix.integer_nullspace()
+	# would overflow int64, so this has to fall back to Python ints
+	huge = Matrix ([[-2 ** 40, 3 ** 30, 0], [0, -5 ** 20, 7 ** 15]])
+	assert huge.numpy_nullspace() == huge.integer_nullspace()
+
+def test_sparse_matrix(): 
+	eq = Equation ("Fe2(SO4)3 + KOH --> K2SO4 + Fe(OH)3")
+	rows = {element.symbol: row for element, row in eq.sparse_matrix.items()}
+	assert rows ["Fe"] == {0: -2, 3: 1}
+	assert rows ["K"] == {1: -1, 2: 2}
+	assert eq.matrix.sparse_nullspace() == eq.matrix.integer_nullspace()
+
+def test_lru_cache(): 
+	cache = LRUCache (maxsize = 2)
+	cache.put ("a", 1)
+	cache.put ("b", 2)
+	assert cache.get ("a") == 1  # "b" is now the least recently used
+	cache.put ("c", 3)
+	assert "b" not in cache and cache.get ("b") is None
+	assert cache.info() ["hits"] == 1 and cache.info() ["evictions"] == 1
+	cache.maxsize = 1
+	assert list (cache.entries) == ["c"]
+
+def test_balance_cache(): 
+	CACHE.clear()
+	first = balance ("Fe + O2 --> Fe2O3")
+	second = balance ("Fe  +  O2-->Fe2O3")
+	assert CACHE.hits == 1 and CACHE.misses == 1
+	assert str (first) == str (second) == "4Fe + 3O2 --> 2Fe2O3"
+
+def test_canonical(): 
+	key, order = Equation ("O2 + H2 --> OH2").canonical()
+	assert key == "H2 + O2 --> H2O"
+	assert order == [1, 0, 2]
+	assert Equation ("H2 + O2 --> H2O").canonical() [0] == key
+	CACHE.clear()
+	balance ("H2 + O2 --> H2O")
+	assert str (balance ("O2 + H2 --> OH2")) == "O2 + 2H2 --> 2OH2"
+	assert CACHE.hits == 1
+	# two free variables, so the answer has to be picked in canonical order
+	first = "Am + PdAm3 + (AmPd)3 --> AmPd + PdAm4 + Am5Pd2"
+	reordered = "PdAm3 + Am + (AmPd)3 --> PdAm4 + AmPd + Am5Pd2"
+	balance (first)
+	assert str (balance (reordered)) == str (balance (reordered, use_cache = False))
+	assert CACHE.hits == 2
+
+def test_isomers(): 
+	# species with the same composition on one side are still separate species
+	for formula, expected in (
+		("C2H5OH + CH3OCH3 + O2 --> CO2 + H2O", "C2H5OH + CH3OCH3 + 6O2 --> 4CO2 + 6H2O"), 
+		("H2O + OH2 --> H2O2 + H2", "H2O + OH2 --> H2O2 + H2"), 
+	): 
+		for _ in range (2):  # the second one comes from the cache
+			assert str (balance (formula)) == expected
+
+def test_balance_many(): 
+	equations = WORKSHEET [:8] + ["H2 --> O2"]
+	for jobs in (1, 2): 
+		results = list (balance_many (equations, jobs = jobs, chunksize = 3))
+		assert [result.index for result in results] == list (range (len (equations)))
+		assert results [0].coefficients == [2, 1, 2]
+		assert results [0].equation == "2H2 + O2 --> 2H2O"
+		assert all (result.error is None for result in results [:-1])
+		assert results [-1].error.startswith ("UnbalanceableError")
+
+	unordered = balance_many (equations, jobs = 2, chunksize = 3, ordered = False)
+	assert sorted (result.index for result in unordered) == list (range (len (equations)))
+
+def test_stream_jsonl(): 
+	output = StringIO()
+	stream_jsonl (["H2 + O2 --> H2O\n", "\n", "H2 --> O2\n"], output, jobs = 1)
+	records = [loads (line) for line in output.getvalue().splitlines()]
+	assert [record ["line"] for record in records] == [1, 3]
+	assert records [0] ["coefficients"] == [2, 1, 2]
+	assert records [1] ["error"] is not None
+
+def test_parse_equation(): 
+	left, right = parse_equation ("3Al(OH)3 + H2SO4-->Al2(SO4)3 + H2O")
+	assert [species.formula for species in left] == ["Al(OH)3", "H2SO4"]
+	assert left [0].coefficient == 3 and right [0].coefficient == 1
+	assert {element.symbol: count for element, count in right [0].elements.items()} == {
+		"Al": 2, "S": 3, "O": 12
+	}
+	assert parse_equation ("2H2O --> H2O") [1] [0].elements is right [1].elements  # see chemicals.COMPOSITIONS
+	for formula in ("H2O)", "H2(O", "H2 + --> O2", "Xx --> H", "h2", "()H --> H"): 
+		try: parse_equation (formula)
+		except ValueError: pass
+		else: raise AssertionError (f"{formula} should not parse")
+
+def test_many_free_variables(): 
+	# 10 free variables is too many to search, so this goes through the simplex
+	left = " + ".join (f"C{n}H{2 * n + 2}" for n in range (1, 9))
+	eq = balance (f"{left} + O2 --> CO2 + H2O + CO + H2")
+	assert eq.is_balanced()
+	assert all (count > 0 for count in eq.left.molecules.values())
+	assert all (count > 0 for count in eq.right.molecules.values())
+
+def test_solvers_agree(): 
+	# more than one free variable, so the answer depends on the search
+	for formula in (
+		"KMnO4 + HCl --> KCl + MnCl2 + H2O + Cl2 + O2", 
+		"C3H8 + O2 --> CO2 + CO + H2O + C", 
+	): 
+		answers = set()
+		for solver in SOLVERS: 
+			eq = Equation (formula)
+			eq.balance (solver)
+			assert eq.is_balanced(), (formula, solver)
+			answers.add (tuple (eq.get_coefficients()))
+		assert len (answers) == 1, (formula, answers)
+
+def test_generated_reactions(): 
+	assert random_reaction (seed = 7) == random_reaction (seed = 7)
+	assert "(" in random_reaction (species = 6, elements = 5, seed = 3, groups = 1).equation
+	for reaction in corpus (100, seed = 1): 
+		assert Equation (reaction.equation).check (reaction.coefficients), reaction
+		if not reaction.unique: continue
+		for solver in SOLVERS: 
+			eq = Equation (reaction.equation)
+			eq.balance (solver)
+			assert eq.get_coefficients() == reaction.coefficients, (reaction, solver)
+
+def test_timing(): 
+	timing.reset()
+	balance ("H2 + O2 --> H2O", use_cache = False)
+	assert timing.stats() == {}  # off by default
+	timing.enable()
+	try: 
+		balance ("Ca3(PO4)2 + SiO2 + C --> CaSiO3 + P4 + CO", use_cache = False)
+		Equation ("H2 + O2 --> H2O").matrix.rref ("bareiss")
+	finally: timing.disable()
+	stats = timing.stats()
+	assert stats ["balance"] ["calls"] == 1
+	assert stats ["Equation.get_matrix"] ["calls"] == 1  # "hnf" works from the factorization
+	assert stats ["Matrix.rref"] ["calls"] == 1
+	assert stats ["balance"] ["seconds"] >= stats ["Equation.balance"] ["seconds"] > 0
+	assert stats ["get_composition"] ["calls"] == 9  # one per species, cached or not
+	timing.reset()
+	COMPOSITIONS.clear()
+	timing.enable()
+	try: Molecule ("Fe2(SO4)3")
+	finally: timing.disable()
+	assert {"get_composition", "parse_formula"} <= timing.stats().keys()
+	assert "Molecule.get_name" not in timing.stats()  # naming only runs when asked for
+	timing.reset()
+	assert timing.stats() == {}
+
+def test_edit_species(): 
+	eq = Equation ("H2 + O2 --> H2O")
+	eq.balance()
+	eq.add_species ("H2O2")
+	assert eq.factorization.nullspace() == eq.matrix.integer_nullspace()
+	eq.replace_species ("H2O", "O3")  # keeps its place
+	eq.balance()
+	assert str (eq) == "H2 + 4O2 --> 2O3 + H2O2"
+	eq.remove_species ("O3")
+	eq.add_species ("NaOH", "left")
+	eq.add_species ("NaH", "right")
+	assert eq.factorization.nullspace() == eq.matrix.integer_nullspace()
+	eq.remove_species ("NaOH")
+	eq.remove_species ("NaH")
+	eq.balance()
+	assert str (eq) == "H2 + O2 --> H2O2"
+	assert eq.factorization.elements == list (eq.sparse_matrix)
+	for reaction in corpus (20, seed = 2, species = (3, 8)): 
+		eq = Equation (reaction.equation)
+		eq.balance()
+		side = "right" if len (eq.right.molecules) > 1 else "left"
+		moved = getattr (eq, side).molecules_list [0].formula
+		eq.remove_species (moved)
+		eq.add_species (moved, "left" if side == "right" else "right")
+		assert eq.factorization.nullspace() == eq.matrix.integer_nullspace(), reaction
+
+def test_imbalance(): 
+	eq = Equation ("H2 + O2 --> H2O")
+	hydrogen, oxygen = eq.sparse_matrix
+	assert eq.imbalance() == {oxygen: -1}
+	assert not eq.is_balanced()
+	assert eq.imbalance ([2, 1, 2]) == {}
+	assert eq.imbalance ([1, 1, 2]) == {hydrogen: 2}
+	vectors = [[2, 1, 2], [1, 1, 1], [1, 1, 2], [2 ** 62, 1, 1]]
+	assert eq.imbalances (vectors) == [eq.imbalance (vector) for vector in vectors]
+	assert eq.imbalances (vectors [:3]) == [{}, {oxygen: -1}, {hydrogen: 2}]
+	eq.balance()
+	assert eq.is_balanced() and eq.left.elements == eq.right.elements
+
+def test_reaction_network(): 
+	network = ReactionNetwork ([
+		"2H2 + O2 --> 2H2O", 
+		"H2O2 --> H2 + O2", 
+		"2H2O2 --> 2H2O + O2", 
+		"H2 + O2 --> H2O", # unbalanced
+	])
+	assert network.get_formulas() == ["H2", "O2", "H2O", "H2O2"]
+	assert network.rank() == 3  # the unbalanced one is not a combination of the rest
+	assert network.conserved_moieties() == [{"H2": 1, "H2O": 1, "H2O2": 1}]  # O is not conserved
+	assert ReactionNetwork (["H2 + O2 --> H2O"], balance = True).columns == [{0: -2, 1: -1, 2: 2}]
+	isomers = ReactionNetwork (["C2H5OH --> CH3OCH3", "CH3OCH3 + 3O2 --> 2CO2 + 3H2O"])
+	assert isomers.get_formulas() == ["C2H5OH", "CH3OCH3", "O2", "CO2", "H2O"]
+	assert isomers.columns [0] == {0: -1, 1: 1} and isomers.dependent_reactions() == {}
+
+	reactions = [reaction.equation.split (" --> ") for reaction in corpus (20, seed = 4)]
+	sums = [  # as written, so each is the sum of two others
+		f"{left} + {other_left} --> {right} + {other_right}"
+		for (left, right), (other_left, other_right) in zip (reactions [::4], reactions [1::4])
 	]
-	for equation in equations: 
+	network = ReactionNetwork ([" --> ".join (reaction) for reaction in reactions] + sums)
+	assert len (network.dependent_reactions()) == len (sums)
+	matrix = network.stoichiometric_matrix().matrix
+	for moiety in network.conserved_moieties(): 
+		weights = [moiety.get (formula, 0) for formula in network.get_formulas()]
+		assert not any (sum (w * row [col] for w, row in zip (weights, matrix)) for col in range (len (network)))
+	for col, combination in network.dependent_reactions().items(): 
+		for row in matrix: 
+			assert row [col] == sum (multiple * row [other] for other, multiple in combination.items())
+
+def test_unbalanceable(): 
+	def reason (equation): 
+		try: Equation (equation).balance()
+		except UnbalanceableError as error: return str (error)
+		raise AssertionError (f"{equation} should not balance")
+
+	assert reason ("H2 --> O2").startswith ("There is an inconsistency")
+	assert reason ("NaCl + KBr --> NaBr + KCl2").startswith ("Only zeros")  # full rank
+	assert reason ("HO + H2O --> H2O2").startswith ("There is no set")  # only (2, 0, 1)
+	# two free variables, but no positive solution, so the slow search never runs
+	timing.reset()
+	timing.enable()
+	try: assert reason ("O4N3H3 + NHO --> N4OH3 + N3 + H").startswith ("There is no set")
+	finally: timing.disable()
+	assert "choose_coefficients" not in timing.stats()
+	assert timing.stats() ["positive_solution"] ["calls"] == 1
+	timing.reset()
+	eq = Equation ("H2 + O2 --> H2O")
+	eq.add_species ("NaCl")
+	try: eq.balance()
+	except UnbalanceableError as error: assert str (error).startswith ("Na only appears on the right")
+	else: raise AssertionError ("Na is only on the right")
+	for reaction in corpus (200, seed = 5):  # never rejects a balanceable equation
+		Equation (reaction.equation).check_balanceable()
+
+def test_budget(): 
+	big = random_reaction (150, 10, seed = 1, symbols = ("H", "O", "C", "N", "S", "P", "Cl", "K", "Na", "Ca")).equation
+	for budget in ({"timeout": 0.005}, {"max_species": 100}, {"max_length": 100}): 
+		try: balance (big, use_cache = False, **budget)
+		except BudgetExceeded: pass
+		else: raise AssertionError (f"{budget} should be exceeded")
+	assert str (balance ("H2 + O2 --> H2O", timeout = 10, max_species = 3)) == "2H2 + O2 --> 2H2O"
+	results = list (balance_many (["H2 + O2 --> H2O", big, "Na + Cl2 --> NaCl"], jobs = 1, timeout = 0.005))
+	assert results [1].error == "BudgetExceeded: Ran out of time"
+	assert results [2].equation == "2Na + Cl2 --> 2NaCl"
+	output = StringIO()
+	stream_jsonl (["H2 + O2 --> H2O\n", big + "\n"], output, jobs = 1, max_length = 100)
+	records = [loads (line) for line in output.getvalue().splitlines()]
+	assert records [0] ["error"] is None and records [1] ["error"].startswith ("BudgetExceeded")
+
+def test_worksheet(): 
+	for equation in WORKSHEET: 
 		eq = Equation (equation)
 		assert not eq.is_balanced()
 		eq.balance()
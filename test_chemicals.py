@@ -0,0 +1,64 @@
+from math import isclose, isnan
+
+from chemicals import get_composition, molar_masses, parse_formula, Composition, Molecule, COMPOSITIONS
+
+def test_parse_formula(): 
+	assert parse_formula ("H2O") == {"H": 2, "O": 1}
+	assert parse_formula ("3Al2(SO4)3") == {"Al": 6, "S": 9, "O": 36}
+	assert parse_formula ("K4(Fe(CN)6)") == {"K": 4, "Fe": 1, "C": 6, "N": 6}
+	formula = "H"
+	for _ in range (30): formula = f"(CH2{formula})2"
+	assert parse_formula (formula) == {"C": 2 ** 31 - 2, "H": 2 ** 32 - 4 + 2 ** 30}
+
+def test_parse_errors(): 
+	for formula, position in (
+		("H2O)", "pos 4"), 
+		("Ca(OH", "pos 3"), 
+		("h2", "pos 1"), 
+		("H2$", "pos 3"), 
+		("()H", "pos 1"), 
+		("Hee", "letters 2 and 3"), 
+	): 
+		try: parse_formula (formula)
+		except ValueError as error: assert position in str (error), error
+		else: raise AssertionError (f"{formula} should not parse")
+
+def test_compositions(): 
+	COMPOSITIONS.clear()
+	water = get_composition ("H2O")
+	assert {element.symbol: count for element, count in water.items()} == {"H": 2, "O": 1}
+	assert get_composition ("H2O") is water
+	assert COMPOSITIONS.info() ["hits"] == 1 and COMPOSITIONS.info() ["misses"] == 1
+	try: water [next (iter (water))] = 3
+	except TypeError: pass
+	else: raise AssertionError ("Compositions should be read only")
+	try: get_composition ("Xx2")
+	except ValueError: assert "Xx2" not in COMPOSITIONS
+	else: raise AssertionError ("Xx is not an element")
+
+def test_composition(): 
+	water = Composition ({"O": 1, "H": 2})
+	assert list (water.pairs()) == [(1, 2), (8, 1)]  # sorted by atomic number
+	assert water == Composition ([(8, 1), (1, 1), (1, 1)]) and hash (water) == hash (get_composition ("H2O"))
+	assert water ["H"] == 2 and "O" in water and "C" not in water and water.get ("C", 0) == 0
+	hydrogen, oxygen = Composition ({"H": 2}), Composition ({"O": 2})
+	assert 2 * hydrogen + oxygen == water * 2
+	assert water * 2 - hydrogen * 2 == oxygen and not water - water
+	assert Molecule ("OH2").composition == Molecule ("H2O").composition and Molecule ("OH2") != Molecule ("H2O")
+	assert Molecule ("H2O").composition is get_composition ("H2O")
+
+def test_lazy_molecule(): 
+	molecule = Molecule ("Fe2O3")
+	assert not {"english_elements", "refined_formula", "mass", "type", "name"} & vars (molecule).keys()
+	assert molecule.name == "Iron(III) Oxide"
+	assert molecule.type == "ionic" and "type" in vars (molecule)
+	assert round (molecule.mass, 2) == 159.69
+
+def test_molar_masses(): 
+	formulas = ["H2O", "Ca3(PO4)2", "Xx2", "", "2H2O", "H2O"]
+	masses, errors = molar_masses (formulas)
+	assert list (errors) == [False, False, True, True, False, False]
+	for formula, mass, error in zip (formulas, masses, errors): 
+		if error: assert isnan (mass)
+		else: assert isclose (mass, Molecule (formula).mass)
+	assert len (molar_masses ([]) [0]) == 0
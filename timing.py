@@ -0,0 +1,63 @@
+"""
+Opt-in timers for the stages of balancing and naming.
+
+Functions decorated with `timed` count their calls and the time spent in them,
+but only while timing is enabled. When it is off, a timed function costs one
+extra call and a flag check, so the decorators can stay in place for good:
+
+>>> import timing
+>>> from balance import balance
+>>> timing.enable()
+>>> equation = balance ("H2 + O2 --> H2O", use_cache = False)
+>>> timing.stats() ["parse_equation"] ["calls"]
+1
+>>> timing.disable()
+
+Times are inclusive, so a stage that calls another stage counts both. A stage
+that calls itself is only counted once.
+"""
+
+from functools import wraps
+from time import perf_counter
+
+enabled = False
+calls: {str: int} = {}
+seconds: {str: float} = {}
+running: {str} = set()  # stages being timed right now, so recursion counts once
+
+def enable (on: bool = True) -> None:
+    global enabled
+    enabled = on
+
+def disable () -> None: enable (False)
+
+def reset () -> None:
+    calls.clear()
+    seconds.clear()
+
+def stats () -> {str: dict}:
+    """A snapshot of every stage that ran: {name: {"calls": int, "seconds": float}}."""
+    return {
+        name: {"calls": count, "seconds": seconds [name]}
+        for name, count in calls.items()
+    }
+
+def timed (function = None, name: str = None):
+    """
+    Times `function` under `name`, which defaults to its qualified name,
+    like "Matrix.rref". Use as `@timed` or `@timed (name = "...")`.
+    """
+    if function is None: return lambda function: timed (function, name)
+    if name is None: name = function.__qualname__
+
+    @wraps (function)
+    def wrapper (*args, **kwargs):
+        if not enabled or name in running: return function (*args, **kwargs)
+        running.add (name)
+        start = perf_counter()
+        try: return function (*args, **kwargs)
+        finally:
+            running.discard (name)
+            calls [name] = calls.get (name, 0) + 1
+            seconds [name] = seconds.get (name, 0.0) + perf_counter() - start
+    return wrapper